@@ -2,10 +2,13 @@ from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 import os
+import multiprocessing
 from dotenv import load_dotenv
 
 # Import database
 from models import db
+from config.credentials import start_key_rotation
+from integrations.token_refresher import start_token_refresher
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +18,8 @@ from blueprints.auth import auth_bp
 from blueprints.integrations import integrations_bp
 from blueprints.user import user_bp
 from blueprints.upload import upload_bp
+from blueprints.datasets import datasets_bp
+from blueprints.admin import admin_bp
 
 # Create Flask app
 app = Flask(__name__)
@@ -37,7 +42,7 @@ CORS(app, resources={
         "origins": [os.getenv('FRONTEND_URL', 'http://localhost:3000')],
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
         "allow_headers": ["Content-Type", "Authorization", "X-Requested-With"],
-        "expose_headers": ["Content-Type", "Authorization"],
+        "expose_headers": ["Content-Type", "Authorization", "X-Upload-Report", "X-Dataset-Id", "X-Query-Cache", "X-Total-Rows"],
         "supports_credentials": True
     }
 })
@@ -47,6 +52,8 @@ app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(integrations_bp, url_prefix='/api/integrations')
 app.register_blueprint(user_bp, url_prefix='/api/user')
 app.register_blueprint(upload_bp, url_prefix='/api/upload')
+app.register_blueprint(datasets_bp, url_prefix='/api/datasets')
+app.register_blueprint(admin_bp, url_prefix='/api/admin')
 
 # Simple test route
 @app.route('/api/test', methods=['GET'])
@@ -57,5 +64,13 @@ def test_api():
 with app.app_context():
     db.create_all()
 
+# Ingestion workers re-import this module when started; the background threads belong to the API process
+if multiprocessing.parent_process() is None:
+    # Re-encrypt credentials still under an old encryption key
+    start_key_rotation()
+    
+    # Renew OAuth tokens before they expire, off the request path
+    start_token_refresher()
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1 @@
+from .routes import admin_bp
\ No newline at end of file
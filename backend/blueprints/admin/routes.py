@@ -0,0 +1,173 @@
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import User
+from config.credentials import get_credentials_cache_stats, get_rotation_status
+from datasets.formats import iter_ndjson_records
+from integrations.utils import get_all_integration_statuses, STATUS_SERVICES
+from integrations.ga_report_cache import get_report_cache_stats
+from integrations.google_clients import get_client_pool_stats
+from integrations.token_refresher import get_refresher_stats
+import os
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+admin_bp = Blueprint('admin', __name__)
+
+# Emails allowed to use the admin endpoints
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+def _is_admin(user):
+    """Check whether a user may use the admin endpoints"""
+    return user is not None and user.email.lower() in ADMIN_EMAILS
+
+@admin_bp.route('/credentials/cache', methods=['GET'])
+@jwt_required()
+def credentials_cache_stats():
+    """Get hit/miss counters of the decrypted credential cache"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not _is_admin(user):
+            logger.warning(f"Non-admin user requested cache stats: {current_user_email}")
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify(get_credentials_cache_stats()), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting credential cache stats: {str(e)}")
+        return jsonify({'error': 'Failed to get credential cache stats'}), 500
+
+@admin_bp.route('/credentials/rotation', methods=['GET'])
+@jwt_required()
+def credentials_rotation_status():
+    """Get the progress of re-encrypting credentials under the current key"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not _is_admin(user):
+            logger.warning(f"Non-admin user requested rotation status: {current_user_email}")
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify(get_rotation_status()), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting rotation status: {str(e)}")
+        return jsonify({'error': 'Failed to get rotation status'}), 500
+
+@admin_bp.route('/integrations/google/stats', methods=['GET'])
+@jwt_required()
+def google_analytics_stats():
+    """Get report cache and client pool counters for Google Analytics"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not _is_admin(user):
+            logger.warning(f"Non-admin user requested Google Analytics stats: {current_user_email}")
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify({
+            'report_cache': get_report_cache_stats(),
+            'client_pool': get_client_pool_stats()
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting Google Analytics stats: {str(e)}")
+        return jsonify({'error': 'Failed to get Google Analytics stats'}), 500
+
+@admin_bp.route('/integrations/refresher', methods=['GET'])
+@jwt_required()
+def token_refresher_stats():
+    """Get counters of the background token refresher"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not _is_admin(user):
+            logger.warning(f"Non-admin user requested token refresher stats: {current_user_email}")
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify(get_refresher_stats()), 200
+        
+    except Exception as e:
+        logger.error(f"Error getting token refresher stats: {str(e)}")
+        return jsonify({'error': 'Failed to get token refresher stats'}), 500
+
+@admin_bp.route('/integrations/status', methods=['GET'])
+@jwt_required()
+def all_integration_statuses():
+    """Stream the integration status of every user as NDJSON"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        if not _is_admin(user):
+            logger.warning(f"Non-admin user requested integration statuses: {current_user_email}")
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        expiring_within_days = request.args.get('expiring_within_days', type=float)
+        if expiring_within_days is not None and expiring_within_days < 0:
+            return jsonify({'error': 'expiring_within_days must not be negative'}), 400
+        
+        services = request.args.getlist('service') or list(STATUS_SERVICES)
+        unknown = [service for service in services if service not in STATUS_SERVICES]
+        if unknown:
+            return jsonify({'error': f"Unknown service: {', '.join(unknown)}"}), 400
+        
+        # Resolve emails up front so the stream does not need the database session
+        emails = dict(User.query.with_entities(User.id, User.email).all())
+        
+        def generate_statuses():
+            for status in get_all_integration_statuses(expiring_within_days, services):
+                yield {
+                    'user_id': status['user_id'],
+                    'email': emails.get(status['user_id']),
+                    'integrations': status['integrations']
+                }
+        
+        logger.info(f"Integration status sweep requested by: {current_user_email}")
+        
+        return Response(
+            stream_with_context(iter_ndjson_records(generate_statuses())),
+            mimetype='application/x-ndjson'
+        )
+        
+    except Exception as e:
+        logger.error(f"Error sweeping integration statuses: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve integration statuses'}), 500
+
+@admin_bp.route('/credentials/cache', methods=['OPTIONS'])
+@admin_bp.route('/credentials/rotation', methods=['OPTIONS'])
+@admin_bp.route('/integrations/google/stats', methods=['OPTIONS'])
+@admin_bp.route('/integrations/refresher', methods=['OPTIONS'])
+@admin_bp.route('/integrations/status', methods=['OPTIONS'])
+def handle_admin_preflight():
+    """Handle preflight request for admin endpoints"""
+    response = jsonify({})
+    return response, 200
\ No newline at end of file
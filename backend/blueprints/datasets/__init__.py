@@ -0,0 +1 @@
+from .routes import datasets_bp
\ No newline at end of file
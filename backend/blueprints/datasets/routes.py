@@ -0,0 +1,152 @@
+from flask import Blueprint, request, jsonify, Response
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import User, Dataset
+from datasets.downsample import downsample_frame
+from datasets.formats import negotiate_format, frame_response, table_to_arrow_ipc, ARROW_MIMETYPE
+from datasets.query import execute_query
+from datasets.stats import compute_column_stats
+from datasets.store import (
+    has_frame, read_frame, read_table, read_stats, write_stats, find_dataset
+)
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Create blueprint
+datasets_bp = Blueprint('datasets', __name__)
+
+@datasets_bp.route('', methods=['GET'])
+@jwt_required()
+def list_datasets():
+    """List the current user's stored datasets"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        datasets = Dataset.query.filter_by(user_id=user.id).order_by(Dataset.created_at.desc()).all()
+        
+        return jsonify([dataset.to_dict() for dataset in datasets]), 200
+        
+    except Exception as e:
+        logger.error(f"Error listing datasets: {str(e)}")
+        return jsonify({'error': 'Failed to list datasets'}), 500
+
+@datasets_bp.route('/<dataset_id>', methods=['GET'])
+@jwt_required()
+def get_dataset(dataset_id):
+    """Serve a stored dataset without re-parsing the upload"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        dataset = find_dataset(user.id, dataset_id)
+        if not dataset or not has_frame(dataset.content_hash):
+            logger.warning(f"Dataset not found: {dataset_id}")
+            return jsonify({'error': 'Dataset not found'}), 404
+        
+        max_points = request.args.get('max_points', type=int)
+        if max_points is not None and max_points < 3:
+            return jsonify({'error': 'max_points must be at least 3'}), 400
+        
+        fmt = negotiate_format(request)
+        
+        # Arrow clients get the stored columns without a pandas round trip
+        if fmt == 'arrow' and not max_points:
+            response = Response(table_to_arrow_ipc(read_table(dataset.content_hash)), mimetype=ARROW_MIMETYPE)
+        else:
+            df = read_frame(dataset.content_hash)
+            if max_points:
+                df = downsample_frame(df, max_points, chart_type=request.args.get('chart_type', 'line'))
+            response = frame_response(df, fmt)
+        
+        response.headers['X-Dataset-Id'] = dataset.content_hash
+        return response, 200
+        
+    except Exception as e:
+        logger.error(f"Error retrieving dataset: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve dataset'}), 500
+
+@datasets_bp.route('/<dataset_id>/summary', methods=['GET'])
+@jwt_required()
+def get_dataset_summary(dataset_id):
+    """Get ingest-time column statistics for a stored dataset"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        dataset = find_dataset(user.id, dataset_id)
+        if not dataset or not has_frame(dataset.content_hash):
+            logger.warning(f"Dataset not found: {dataset_id}")
+            return jsonify({'error': 'Dataset not found'}), 404
+        
+        # Datasets stored before statistics existed get them computed once here
+        stats = read_stats(dataset.content_hash)
+        if stats is None:
+            stats = compute_column_stats(read_frame(dataset.content_hash))
+            write_stats(dataset.content_hash, stats)
+        
+        # Report the label/value columns under their original names
+        names = dict(zip(['label', 'value'], dataset.columns[:2]))
+        
+        return jsonify({
+            'dataset': dataset.to_dict(),
+            'report': dataset.report,
+            'columns': {names.get(column, column): column_stats for column, column_stats in stats.items()}
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error retrieving dataset summary: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve dataset summary'}), 500
+
+@datasets_bp.route('/<dataset_id>/query', methods=['POST'])
+@jwt_required()
+def query_dataset(dataset_id):
+    """Run a group-by/filter/sort/top-N query over a stored dataset"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        dataset = find_dataset(user.id, dataset_id)
+        if not dataset or not has_frame(dataset.content_hash):
+            logger.warning(f"Dataset not found: {dataset_id}")
+            return jsonify({'error': 'Dataset not found'}), 404
+        
+        result, error, cached = execute_query(dataset, request.get_json(silent=True))
+        if error:
+            logger.warning(f"Invalid query for dataset {dataset_id}: {error}")
+            return jsonify({'error': error}), 400
+        
+        response = frame_response(result, negotiate_format(request))
+        response.headers['X-Query-Cache'] = 'hit' if cached else 'miss'
+        return response, 200
+        
+    except Exception as e:
+        logger.error(f"Error querying dataset: {str(e)}")
+        return jsonify({'error': 'Failed to query dataset'}), 500
+
+@datasets_bp.route('', methods=['OPTIONS'])
+@datasets_bp.route('/<dataset_id>', methods=['OPTIONS'])
+@datasets_bp.route('/<dataset_id>/summary', methods=['OPTIONS'])
+@datasets_bp.route('/<dataset_id>/query', methods=['OPTIONS'])
+def handle_datasets_preflight(dataset_id=None):
+    """Handle preflight request for dataset endpoints"""
+    response = jsonify({})
+    return response, 200
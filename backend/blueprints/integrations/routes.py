@@ -1,6 +1,18 @@
-from flask import Blueprint, request, jsonify, make_response
+from flask import Blueprint, request, jsonify, make_response, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User
+from integrations.google_analytics import (
+    get_analytics_data, get_analytics_pages, get_analytics_reports, GA_BATCH_MAX_REPORTS, GA_DATE_FORMAT,
+    SHARD_REPORT_ERROR
+)
+from integrations.meta_ads import (
+    get_ad_insights, get_ad_insight_pages, get_multi_account_insights,
+    is_insight_field, INSIGHT_LEVELS, META_FANOUT_MAX_ACCOUNTS, SHARD_ASYNC_ERROR
+)
+from integrations.meta_jobs import read_job_status, result_path, JOBS_BUSY_ERROR
+from integrations.sharding import SHARD_SIZES
+from datasets.formats import iter_ndjson_records, negotiate_format, frame_response
+import pandas as pd
 import logging
 
 # Configure logging
@@ -172,6 +184,374 @@ def test_meta_connection():
             "error": "Failed to connect to Meta Ads API"
         }), 500
 
+def _list_arg(name):
+    """Read a comma-separated query parameter as a list, or None when absent"""
+    value = request.args.get(name)
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+@integrations_bp.route('/google/data', methods=['GET'])
+@jwt_required()
+def get_google_data():
+    """Get a Google Analytics report, optionally streamed as NDJSON rows"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        property_id = request.args.get('property_id')
+        if not property_id:
+            return jsonify({"error": "property_id is required"}), 400
+        
+        report_args = dict(
+            start_date=request.args.get('start_date'),
+            end_date=request.args.get('end_date'),
+            metrics=_list_arg('metrics'),
+            dimensions=_list_arg('dimensions')
+        )
+        
+        stream = request.args.get('stream') in ('1', 'true') or request.accept_mimetypes.best == 'application/x-ndjson'
+        if not stream:
+            shard = request.args.get('shard')
+            if shard and shard not in SHARD_SIZES:
+                return jsonify({"error": f"shard must be one of: {', '.join(SHARD_SIZES)}"}), 400
+            
+            # Columnar and Arrow clients get typed columns straight from the decoder
+            fmt = negotiate_format(request)
+            data, error = get_analytics_data(user.id, property_id, columnar=fmt != 'records', shard=shard, **report_args)
+            if error == SHARD_REPORT_ERROR:
+                return jsonify({"error": error}), 400
+            if error:
+                logger.warning(f"Google Analytics report failed for user {current_user_email}: {error}")
+                return jsonify({"error": error}), 502
+            
+            if fmt != 'records':
+                df = pd.DataFrame(data["columns"])
+                
+                # Columnar JSON labels dates like the records form; Arrow keeps the typed date
+                if fmt == 'columnar' and pd.api.types.is_datetime64_any_dtype(df.get('date')):
+                    df['date'] = df['date'].dt.strftime(GA_DATE_FORMAT)
+                
+                return frame_response(df, fmt)
+            
+            return jsonify(data), 200
+        
+        page_size = request.args.get('page_size', type=int)
+        if page_size is not None and not 1 <= page_size <= 250000:
+            return jsonify({"error": "page_size must be between 1 and 250000"}), 400
+        
+        # The first page is fetched here so errors still get a proper status code
+        pages, error = get_analytics_pages(user.id, property_id, page_size=page_size, **report_args)
+        if error:
+            logger.warning(f"Google Analytics report failed for user {current_user_email}: {error}")
+            return jsonify({"error": error}), 502
+        first_page = next(pages)
+
+        def generate_rows():
+            yield from first_page["rows"]
+            try:
+                for page in pages:
+                    yield from page["rows"]
+            except Exception as e:
+                # Headers are already sent, so report the failure in-band
+                logger.error(f"Error streaming Google Analytics report: {str(e)}")
+                yield {"error": "Failed to retrieve the rest of the report"}
+        
+        response = Response(
+            stream_with_context(iter_ndjson_records(generate_rows())),
+            mimetype='application/x-ndjson'
+        )
+        response.headers['X-Total-Rows'] = str(first_page["row_count"])
+        
+        return response
+    
+    except Exception as e:
+        logger.error(f"Error retrieving Google Analytics data: {str(e)}")
+        return jsonify({"error": "Failed to retrieve Google Analytics data"}), 500
+
+@integrations_bp.route('/meta/data', methods=['GET'])
+@jwt_required()
+def get_meta_data():
+    """Get Meta Ads insights, optionally streamed page by page as NDJSON"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        account_id = request.args.get('account_id')
+        if not account_id:
+            return jsonify({"error": "account_id is required"}), 400
+        
+        # Only the requested fields are fetched from the Graph API
+        fields = _list_arg('fields')
+        unknown = [field for field in fields or [] if not is_insight_field(field)]
+        if unknown:
+            return jsonify({"error": f"Unknown insights field: {', '.join(unknown)}"}), 400
+        
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        
+        stream = request.args.get('stream') in ('1', 'true') or request.accept_mimetypes.best == 'application/x-ndjson'
+        if not stream:
+            shard = request.args.get('shard')
+            if shard and shard not in SHARD_SIZES:
+                return jsonify({"error": f"shard must be one of: {', '.join(SHARD_SIZES)}"}), 400
+            
+            insights, error = get_ad_insights(user.id, account_id, start_date, end_date, fields, shard=shard)
+            if error:
+                logger.warning(f"Meta Ads insights failed for user {current_user_email}: {error}")
+                return jsonify({"error": error}), 502
+            
+            return jsonify(insights), 200
+        
+        level = request.args.get('level', 'campaign')
+        if level not in INSIGHT_LEVELS:
+            return jsonify({"error": f"level must be one of: {', '.join(INSIGHT_LEVELS)}"}), 400
+        
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit < 1:
+            return jsonify({"error": "limit must be positive"}), 400
+        
+        # The first page is fetched here so errors still get a proper status code
+        pages, error = get_ad_insight_pages(user.id, account_id, start_date, end_date, fields, level=level, limit=limit)
+        if error:
+            logger.warning(f"Meta Ads insights failed for user {current_user_email}: {error}")
+            return jsonify({"error": error}), 502
+        first_page = next(pages)
+
+        def generate_insights():
+            yield from first_page
+            try:
+                for page in pages:
+                    yield from page
+            except Exception as e:
+                # Headers are already sent, so report the failure in-band
+                logger.error(f"Error streaming Meta Ads insights: {str(e)}")
+                yield {"error": "Failed to retrieve the rest of the insights"}
+        
+        return Response(
+            stream_with_context(iter_ndjson_records(generate_insights())),
+            mimetype='application/x-ndjson'
+        )
+    
+    except Exception as e:
+        logger.error(f"Error retrieving Meta Ads insights: {str(e)}")
+        return jsonify({"error": "Failed to retrieve Meta Ads insights"}), 500
+
+@integrations_bp.route('/meta/insights/jobs', methods=['POST'])
+@jwt_required()
+def start_meta_insights_job():
+    """Start an async Meta Ads insights report and return its job"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        data = request.get_json(silent=True) or {}
+        account_id = data.get('account_id')
+        if not account_id:
+            return jsonify({"error": "account_id is required"}), 400
+        
+        fields = data.get('fields')
+        if fields is not None and (not isinstance(fields, list) or not all(isinstance(f, str) and is_insight_field(f) for f in fields)):
+            return jsonify({"error": "fields must be a list of insights fields"}), 400
+        
+        level = data.get('level', 'campaign')
+        if level not in INSIGHT_LEVELS:
+            return jsonify({"error": f"level must be one of: {', '.join(INSIGHT_LEVELS)}"}), 400
+        
+        status, error = get_ad_insights(
+            user.id, account_id, data.get('start_date'), data.get('end_date'), fields,
+            async_job=True, level=level, shard=data.get('shard')
+        )
+        if error == SHARD_ASYNC_ERROR:
+            return jsonify({"error": error}), 400
+        if error == JOBS_BUSY_ERROR:
+            return jsonify({"error": error}), 503
+        if error:
+            logger.warning(f"Meta Ads insights job failed to start for user {current_user_email}: {error}")
+            return jsonify({"error": error}), 502
+        
+        logger.info(f"Meta Ads insights job {status['id']} started for user: {current_user_email}")
+        
+        status.pop('user_id', None)
+        return jsonify(status), 202
+    
+    except Exception as e:
+        logger.error(f"Error starting Meta Ads insights job: {str(e)}")
+        return jsonify({"error": "Failed to start Meta Ads insights job"}), 500
+
+@integrations_bp.route('/meta/insights/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_meta_insights_job(job_id):
+    """Get the state of an async Meta Ads insights job"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        status = read_job_status(job_id)
+        if not status or status.get('user_id') != user.id:
+            logger.warning(f"Meta Ads insights job not found: {job_id}")
+            return jsonify({"error": "Job not found"}), 404
+        
+        status.pop('user_id', None)
+        return jsonify(status), 200
+    
+    except Exception as e:
+        logger.error(f"Error retrieving Meta Ads insights job: {str(e)}")
+        return jsonify({"error": "Failed to retrieve job"}), 500
+
+@integrations_bp.route('/meta/insights/jobs/<job_id>/result', methods=['GET'])
+@jwt_required()
+def get_meta_insights_job_result(job_id):
+    """Stream the stored rows of a finished Meta Ads insights job as NDJSON"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        status = read_job_status(job_id)
+        if not status or status.get('user_id') != user.id:
+            logger.warning(f"Meta Ads insights job not found: {job_id}")
+            return jsonify({"error": "Job not found"}), 404
+        
+        if status.get('state') != 'completed':
+            return jsonify({"error": f"Job is {status.get('state')}"}), 409
+
+        def generate_lines():
+            with open(result_path(job_id)) as f:
+                yield from f
+        
+        return Response(stream_with_context(generate_lines()), mimetype='application/x-ndjson')
+    
+    except Exception as e:
+        logger.error(f"Error retrieving Meta Ads insights job result: {str(e)}")
+        return jsonify({"error": "Failed to retrieve job result"}), 500
+
+@integrations_bp.route('/meta/insights/batch', methods=['POST'])
+@jwt_required()
+def get_meta_insights_bundle():
+    """Get Meta Ads insights for several accounts in one response"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        data = request.get_json(silent=True) or {}
+        account_ids = data.get('account_ids')
+        
+        # Validate the bundle
+        if not isinstance(account_ids, list) or not account_ids or not all(isinstance(a, (str, int)) for a in account_ids):
+            return jsonify({"error": "account_ids must be a non-empty list"}), 400
+        if len(account_ids) > META_FANOUT_MAX_ACCOUNTS:
+            return jsonify({"error": f"At most {META_FANOUT_MAX_ACCOUNTS} accounts per request"}), 400
+        
+        fields = data.get('fields')
+        if fields is not None and (not isinstance(fields, list) or not all(isinstance(f, str) and is_insight_field(f) for f in fields)):
+            return jsonify({"error": "fields must be a list of insights fields"}), 400
+        
+        level = data.get('level', 'campaign')
+        if level not in INSIGHT_LEVELS:
+            return jsonify({"error": f"level must be one of: {', '.join(INSIGHT_LEVELS)}"}), 400
+        
+        result, error = get_multi_account_insights(
+            user.id, account_ids, data.get('start_date'), data.get('end_date'), fields, level=level
+        )
+        if error:
+            logger.warning(f"Meta Ads bundle failed for user {current_user_email}: {error}")
+            return jsonify({"error": error}), 502
+        
+        failed = sum(1 for summary in result["accounts"] if summary["error"])
+        logger.info(
+            f"Meta Ads insights for {len(result['accounts'])} accounts retrieved for user: {current_user_email} "
+            f"({failed} failed, peak usage {result['throttle']['peak_usage_pct']}%)"
+        )
+        
+        return jsonify(result), 200
+    
+    except Exception as e:
+        logger.error(f"Error retrieving Meta Ads bundle: {str(e)}")
+        return jsonify({"error": "Failed to retrieve Meta Ads insights"}), 500
+
+@integrations_bp.route('/google/reports/batch', methods=['POST'])
+@jwt_required()
+def get_google_report_bundle():
+    """Get several Google Analytics reports for one property in one response"""
+    try:
+        current_user_email = get_jwt_identity()
+        user = User.query.filter_by(email=current_user_email).first()
+        
+        if not user:
+            logger.warning(f"User not found: {current_user_email}")
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        data = request.get_json(silent=True) or {}
+        property_id = data.get('property_id')
+        specs = data.get('reports')
+        
+        # Validate the bundle
+        if not property_id:
+            return jsonify({"error": "property_id is required"}), 400
+        if not isinstance(specs, list) or not specs:
+            return jsonify({"error": "reports must be a non-empty list"}), 400
+        if len(specs) > GA_BATCH_MAX_REPORTS:
+            return jsonify({"error": f"At most {GA_BATCH_MAX_REPORTS} reports per bundle"}), 400
+        for spec in specs:
+            if not isinstance(spec, dict):
+                return jsonify({"error": "Each report must be an object"}), 400
+            for field in ('metrics', 'dimensions'):
+                values = spec.get(field)
+                if values is not None and (not isinstance(values, list) or not all(isinstance(v, str) for v in values)):
+                    return jsonify({"error": f"{field} must be a list of names"}), 400
+        
+        reports, error = get_analytics_reports(user.id, property_id, specs)
+        if error:
+            logger.warning(f"Google Analytics bundle failed for user {current_user_email}: {error}")
+            return jsonify({"error": error}), 502
+        
+        logger.info(f"Google Analytics bundle of {len(specs)} reports retrieved for user: {current_user_email}")
+        
+        return jsonify({"reports": reports}), 200
+    
+    except Exception as e:
+        logger.error(f"Error retrieving Google Analytics bundle: {str(e)}")
+        return jsonify({"error": "Failed to retrieve Google Analytics reports"}), 500
+
+@integrations_bp.route('/google/data', methods=['OPTIONS'])
+@integrations_bp.route('/google/reports/batch', methods=['OPTIONS'])
+def options_google_reports():
+    """Handle preflight request for the Google Analytics report endpoints"""
+    response = make_response()
+    return response
+
+@integrations_bp.route('/meta/data', methods=['OPTIONS'])
+@integrations_bp.route('/meta/insights/batch', methods=['OPTIONS'])
+@integrations_bp.route('/meta/insights/jobs', methods=['OPTIONS'])
+@integrations_bp.route('/meta/insights/jobs/<job_id>', methods=['OPTIONS'])
+@integrations_bp.route('/meta/insights/jobs/<job_id>/result', methods=['OPTIONS'])
+def options_meta_data(job_id=None):
+    """Handle preflight request for the Meta Ads insights endpoints"""
+    response = make_response()
+    return response
+
 @integrations_bp.route('/settings', methods=['OPTIONS'])
 def options_integration_settings():
     """Handle preflight request for settings endpoint"""
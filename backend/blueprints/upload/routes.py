@@ -1,7 +1,24 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import User
+from datasets.parsing import (
+    peek_stream, detect_dialect, read_csv_frame, iter_csv_chunks, prepare_chart_frame,
+    compression_for, is_supported_upload, open_decompressed
+)
+from datasets.downsample import downsample_frame
+from datasets.dtypes import optimize_frame
+from datasets.formats import iter_ndjson, iter_json_array, negotiate_format, frame_response
+from datasets.stats import compute_column_stats
+from datasets.store import (
+    spool_and_hash, has_frame, write_frame, read_frame, write_stats,
+    find_dataset, find_dataset_by_hash, register_dataset
+)
+from datasets.jobs import (
+    reserve_slot, release_slot, new_job_id, spool_upload, discard_upload,
+    submit_ingest, read_job_status, write_job_status
+)
+import json
 import pandas as pd
-import os
 import logging
 
 # Configure logging
@@ -11,85 +28,269 @@ logger = logging.getLogger(__name__)
 # Create blueprint
 upload_bp = Blueprint('upload', __name__)
 
+def _get_current_user():
+    """Return the authenticated user, or None for anonymous uploads"""
+    current_user_email = get_jwt_identity()
+    if not current_user_email:
+        return None
+    return User.query.filter_by(email=current_user_email).first()
+
+def _store_upload(user, content_hash, filename, size_bytes, df, columns, report):
+    """Persist a parsed upload and record it for the user"""
+    try:
+        if not has_frame(content_hash):
+            write_frame(content_hash, df)
+            write_stats(content_hash, compute_column_stats(df))
+        return register_dataset(user.id, content_hash, filename, size_bytes, len(df), columns, report)
+    except Exception as e:
+        # Storage problems should not fail the upload itself
+        logger.error(f"Error storing dataset {content_hash}: {str(e)}")
+        return None
+
+def _is_enabled(name):
+    """Check whether a boolean query parameter is switched on"""
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+def _header_report(report):
+    """Drop per-column memory details from a parse report to keep headers small"""
+    if 'memory' not in report:
+        return report
+    memory = {key: value for key, value in report['memory'].items() if key != 'columns'}
+    return dict(report, memory=memory)
+
+def _wants_stream():
+    """Check whether the client asked for a streamed upload response"""
+    if _is_enabled('stream'):
+        return True
+    return request.accept_mimetypes.best == 'application/x-ndjson'
+
+def _get_upload_source():
+    """Return (stream, filename, compression, error) for a multipart file or a raw CSV body
+    
+    Only raw bodies are parsed straight off the socket. Werkzeug spools multipart
+    files to its own temporary file (past 500 KB) before the view sees them, so
+    clients that must avoid touching disk should send text/csv instead.
+    """
+    # Raw CSV bodies are read straight from the request stream
+    if request.mimetype in ('text/csv', 'application/octet-stream'):
+        filename = request.args.get('filename', 'upload.csv')
+        compression = compression_for(filename, request.headers.get('Content-Encoding'))
+        return request.stream, filename, compression, None
+    
+    # Check if file is in the request
+    if 'file' not in request.files:
+        logger.warning("No file part in the request")
+        return None, None, None, 'No file part'
+        
+    file = request.files['file']
+    
+    # Check if file is selected
+    if file.filename == '':
+        logger.warning("No file selected")
+        return None, None, None, 'No file selected'
+        
+    # Check file extension
+    if not is_supported_upload(file.filename):
+        logger.warning(f"Invalid file type: {file.filename}")
+        return None, None, None, 'Only CSV files (optionally .gz, .bz2 or .zst compressed) are allowed'
+    
+    return file.stream, file.filename, compression_for(file.filename), None
+
+def _stream_upload(stream, filename, compression):
+    """Parse an upload chunk by chunk and stream the records back"""
+    # Detect the dialect once from a sample, then parse the rest in chunks;
+    # every chunk keeps the first chunk's dtypes so a column never changes type mid-stream
+    sample, stream = peek_stream(open_decompressed(stream, compression))
+    dialect = detect_dialect(sample)
+    chunks = iter_csv_chunks(stream, dialect, fixed_dtypes=True)
+    
+    # Parse the first chunk eagerly so bad files still get a proper status code
+    first_chunk = next(chunks, None)
+    if first_chunk is None or len(first_chunk.columns) < 2:
+        chunks.close()
+        logger.warning("CSV file must have at least two columns")
+        return jsonify({'error': 'CSV file must have at least two columns'}), 400
+    
+    def generate_frames():
+        rows = 0
+        try:
+            yield prepare_chart_frame(first_chunk)
+            rows += len(first_chunk)
+            
+            for chunk in chunks:
+                yield prepare_chart_frame(chunk)
+                rows += len(chunk)
+            
+            logger.info(f"File streamed successfully: {filename} ({rows} rows)")
+        except ValueError as e:
+            # Headers are already sent, so report the failure in-band
+            logger.error(f"Error streaming {filename} after {rows} rows: {str(e)}")
+            yield pd.DataFrame([{'error': f"Rows after {rows} do not match the column types of the first rows"}])
+        finally:
+            chunks.close()
+    
+    # Chunked JSON array or newline-delimited JSON records
+    if request.args.get('format') == 'json':
+        body, mimetype = iter_json_array(generate_frames()), 'application/json'
+    else:
+        body, mimetype = iter_ndjson(generate_frames()), 'application/x-ndjson'
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['X-Upload-Report'] = json.dumps({
+        'dialect': {key: dialect[key] for key in ('delimiter', 'quotechar', 'header', 'encoding')},
+        'engine': 'c'
+    })
+    return response, 200
+
+def _queue_upload(stream, filename, compression):
+    """Spool an upload to disk and parse it in a background job"""
+    user = _get_current_user()
+    if not user:
+        logger.warning("Async upload without authentication")
+        return jsonify({'error': 'Authentication required for async uploads'}), 401
+    
+    # Bound the number of queued jobs so ingestion cannot pile up
+    if not reserve_slot():
+        logger.warning("Ingestion queue is full")
+        return jsonify({'error': 'Too many uploads in progress, try again later'}), 503
+    
+    job_id = new_job_id()
+    submitted = False
+    try:
+        path, content_hash, size_bytes = spool_upload(job_id, stream)
+        
+        # Identical bytes are already stored, so the job completes immediately
+        existing = find_dataset(user.id, content_hash) or find_dataset_by_hash(content_hash)
+        if existing and has_frame(content_hash):
+            register_dataset(user.id, content_hash, filename, size_bytes,
+                             existing.row_count, existing.columns, existing.report)
+            write_job_status(
+                job_id, state='completed', user_id=user.id, filename=filename,
+                bytes_total=size_bytes, bytes_processed=size_bytes,
+                rows_parsed=existing.row_count, dataset_id=content_hash, error=None
+            )
+        else:
+            submit_ingest(current_app._get_current_object(), job_id, user.id,
+                          filename, path, content_hash, size_bytes, compression)
+            submitted = True
+    finally:
+        if not submitted:
+            release_slot()
+            discard_upload(job_id)
+    
+    logger.info(f"Ingestion job {job_id} queued: {filename}")
+    
+    return jsonify({
+        'job_id': job_id,
+        'status_url': f"{request.script_root}/api/upload/jobs/{job_id}"
+    }), 202
+
 @upload_bp.route('', methods=['POST'])
+@jwt_required(optional=True)
 def upload_file():
     """Upload a CSV file and return the parsed data"""
     try:
         logger.info("File upload request received")
         
-        # Check if file is in the request
-        if 'file' not in request.files:
-            logger.warning("No file part in the request")
-            return jsonify({'error': 'No file part'}), 400
-            
-        file = request.files['file']
+        stream, filename, compression, error = _get_upload_source()
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Check if file is selected
-        if file.filename == '':
-            logger.warning("No file selected")
-            return jsonify({'error': 'No file selected'}), 400
-            
-        # Check file extension
-        if not file.filename.endswith('.csv'):
-            logger.warning(f"Invalid file type: {file.filename}")
-            return jsonify({'error': 'Only CSV files are allowed'}), 400
-            
-        # Save file temporarily
-        temp_path = os.path.join('/tmp', file.filename)
-        file.save(temp_path)
+        # Async mode hands the upload to a background ingestion job
+        if _is_enabled('async'):
+            return _queue_upload(stream, filename, compression)
         
-        # Try to read CSV file with different delimiters
-        try:
-            # First try standard comma delimiter
-            df = pd.read_csv(temp_path)
-        except:
-            try:
-                # Try semicolon delimiter
-                df = pd.read_csv(temp_path, sep=';')
-            except:
-                # Try tab delimiter as last resort
-                df = pd.read_csv(temp_path, sep='\t')
-        
-        # Ensure we have at least two columns for charting
-        if len(df.columns) < 2:
-            logger.warning("CSV file must have at least two columns")
-            return jsonify({'error': 'CSV file must have at least two columns'}), 400
-        
-        # Rename columns to ensure they're chart-friendly
-        if len(df.columns) >= 2:
-            # Keep original column names
-            original_columns = df.columns.tolist()
+        # Streaming mode parses in bounded chunks without a temporary file
+        if _wants_stream():
+            return _stream_upload(stream, filename, compression)
+        
+        # Detect the dialect from a sample and parse the file in one pass
+        engine = request.args.get('engine', 'auto')
+        if engine not in ('auto', 'pyarrow', 'c'):
+            return jsonify({'error': 'Invalid parse engine'}), 400
+        
+        max_points = request.args.get('max_points', type=int)
+        if max_points is not None and max_points < 3:
+            return jsonify({'error': 'max_points must be at least 3'}), 400
+        
+        # Authenticated uploads are stored under the hash of their bytes
+        user = _get_current_user()
+        dataset = None
+        if user:
+            stream, content_hash, size_bytes = spool_and_hash(stream)
+            dataset = find_dataset(user.id, content_hash) or find_dataset_by_hash(content_hash)
+        
+        if dataset and has_frame(content_hash):
+            # Identical bytes were uploaded before, so skip parsing entirely
+            df = read_frame(content_hash)
+            report = dict(dataset.report, deduplicated=True)
+            if dataset.user_id != user.id:
+                dataset = _store_upload(user, content_hash, filename, size_bytes, df, dataset.columns, dataset.report)
+        else:
+            # Compressed uploads are inflated incrementally as the parser reads them
+            df, report = read_csv_frame(open_decompressed(stream, compression), engine=engine)
             
-            # For charting purposes, ensure first column is 'label' and second is 'value'
-            chart_columns = original_columns.copy()
-            chart_columns[0] = 'label'
-            chart_columns[1] = 'value'
+            # Ensure we have at least two columns for charting
+            if len(df.columns) < 2:
+                logger.warning("CSV file must have at least two columns")
+                return jsonify({'error': 'CSV file must have at least two columns'}), 400
             
-            # Create a mapping from original to chart columns
-            column_mapping = {original_columns[i]: chart_columns[i] for i in range(len(original_columns))}
+            # Rename columns to ensure they're chart-friendly
+            columns = df.columns.tolist()
+            df = prepare_chart_frame(df)
             
-            # Rename columns
-            df = df.rename(columns=column_mapping)
+            # Store compact dtypes (categoricals, downcast numbers, datetimes)
+            df, report['memory'] = optimize_frame(df)
             
-            # Ensure value column is numeric
-            df['value'] = pd.to_numeric(df['value'], errors='coerce').fillna(0)
+            if user:
+                dataset = _store_upload(user, content_hash, filename, size_bytes, df, columns, report)
         
-        # Convert DataFrame to list of dictionaries
-        data = df.to_dict('records')
+        # Downsample large series so the chart keeps its shape with fewer points
+        if max_points:
+            rows = len(df)
+            df = downsample_frame(df, max_points, chart_type=request.args.get('chart_type', 'line'))
+            report['downsampled'] = {'rows': rows, 'points': len(df)}
         
-        # Remove temporary file
-        os.remove(temp_path)
+        logger.info(f"File uploaded and processed successfully: {filename} "
+                    f"({report['engine']} engine, {report['parse_ms']} ms)")
         
-        logger.info(f"File uploaded and processed successfully: {file.filename}")
-        
-        return jsonify(data), 200
+        # Records by default, columnar JSON or Arrow IPC when negotiated
+        response = frame_response(df, negotiate_format(request))
+        response.headers['X-Upload-Report'] = json.dumps(_header_report(report))
+        if dataset:
+            response.headers['X-Dataset-Id'] = dataset.content_hash
+        return response, 200
         
     except Exception as e:
         logger.error(f"Error processing file upload: {str(e)}")
         return jsonify({'error': 'Failed to process file'}), 500
 
+@upload_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_upload_job(job_id):
+    """Get progress of a background ingestion job"""
+    try:
+        user = _get_current_user()
+        
+        if not user:
+            logger.warning(f"User not found: {get_jwt_identity()}")
+            return jsonify({'error': 'User not found'}), 404
+        
+        status = read_job_status(job_id)
+        if not status or status.get('user_id') != user.id:
+            logger.warning(f"Ingestion job not found: {job_id}")
+            return jsonify({'error': 'Job not found'}), 404
+        
+        status.pop('user_id', None)
+        return jsonify(status), 200
+        
+    except Exception as e:
+        logger.error(f"Error retrieving ingestion job: {str(e)}")
+        return jsonify({'error': 'Failed to retrieve job'}), 500
+
 @upload_bp.route('', methods=['OPTIONS'])
-def handle_upload_preflight():
+@upload_bp.route('/jobs/<job_id>', methods=['OPTIONS'])
+def handle_upload_preflight(job_id=None):
     """Handle preflight request for upload endpoint"""
     response = jsonify({})
     return response, 200 
\ No newline at end of file
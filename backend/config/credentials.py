@@ -1,23 +1,97 @@
 import os
+import copy
 import json
-from cryptography.fernet import Fernet
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-# Get encryption key from environment or generate one
+# Legacy file storing every user's credentials in one encrypted blob
+CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), 'credentials.json')
+
+# SQLite database storing one encrypted record per (user, service)
+CREDENTIALS_DB = os.getenv('CREDENTIALS_DB', os.path.join(os.path.dirname(__file__), 'credentials.db'))
+
+def _has_stored_credentials():
+    """Check whether any encrypted credentials already exist on disk"""
+    if os.path.exists(CREDENTIALS_FILE):
+        return True
+    
+    if not os.path.exists(CREDENTIALS_DB):
+        return False
+    
+    try:
+        conn = sqlite3.connect(f"file:{CREDENTIALS_DB}?mode=ro", uri=True)
+        try:
+            return conn.execute('SELECT 1 FROM credentials LIMIT 1').fetchone() is not None
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+
+# Get encryption key from environment; a generated key only suits an empty store
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY')
 if not ENCRYPTION_KEY:
+    if _has_stored_credentials():
+        raise RuntimeError("ENCRYPTION_KEY is not set but encrypted credentials exist; refusing to start with a new key")
+    
     ENCRYPTION_KEY = Fernet.generate_key().decode()
-    print(f"Generated new encryption key: {ENCRYPTION_KEY}")
-    print("Add this to your .env file as ENCRYPTION_KEY")
+    print("WARNING: ENCRYPTION_KEY is not set; using a temporary key, credentials saved now will be unreadable after a restart")
+    print(f"Add this to your .env file as ENCRYPTION_KEY: {ENCRYPTION_KEY}")
 
-# Initialize encryption
-cipher_suite = Fernet(ENCRYPTION_KEY.encode())
+# Previous keys, still accepted for reading while records are re-encrypted
+ENCRYPTION_OLD_KEYS = [key.strip() for key in os.getenv('ENCRYPTION_OLD_KEYS', '').split(',') if key.strip()]
 
-# File to store encrypted credentials
-CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), 'credentials.json')
+def key_id(key):
+    """Get a short, non-secret identifier for a Fernet key"""
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+# Initialize encryption: new data uses the first key, any key can decrypt
+cipher_suite = MultiFernet([Fernet(key.encode()) for key in [ENCRYPTION_KEY] + ENCRYPTION_OLD_KEYS])
+PRIMARY_KEY_ID = key_id(ENCRYPTION_KEY)
+
+# Background re-encryption throttling
+CREDENTIALS_ROTATION_BATCH = int(os.getenv('CREDENTIALS_ROTATION_BATCH', '100'))
+CREDENTIALS_ROTATION_INTERVAL = float(os.getenv('CREDENTIALS_ROTATION_INTERVAL', '1.0'))
+
+# Per-thread database connections
+_local = threading.local()
+
+# Background rotation thread of this process
+_rotation_thread = None
+_rotation_lock = threading.Lock()
+
+# Decrypted credential cache sizing
+CREDENTIALS_CACHE_SIZE = int(os.getenv('CREDENTIALS_CACHE_SIZE', '1024'))
+CREDENTIALS_CACHE_TTL = float(os.getenv('CREDENTIALS_CACHE_TTL', '300'))
+
+# (user_id, service) -> (expires_at, credentials), least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+# Bumped by every invalidation, so a read that raced one does not cache what it read
+_cache_generation = 0
+
+# Writes are logged so other processes can drop just the records that changed; this many entries are kept
+CREDENTIALS_CHANGE_LOG_SIZE = 10000
+
+# Last change log version this process has applied to its cache
+_seen_version = None
+_version_lock = threading.Lock()
+
+# A record's last use is written at most this often per process, in seconds
+CREDENTIALS_USE_RESOLUTION = 3600
+
+# (user_id, service) -> when this process last wrote its use
+_last_used = {}
+_last_used_lock = threading.Lock()
 
 def encrypt_data(data):
     """Encrypt sensitive data"""
@@ -30,73 +104,461 @@ def decrypt_data(encrypted_data):
     decrypted_data = cipher_suite.decrypt(encrypted_data)
     return json.loads(decrypted_data.decode())
 
-def save_credentials(user_id, service, credentials):
-    """Save encrypted credentials for a user and service"""
-    # Load existing credentials
-    all_credentials = {}
-    if os.path.exists(CREDENTIALS_FILE):
-        with open(CREDENTIALS_FILE, 'rb') as f:
+def _connect(migrate=True):
+    """Get this thread's connection to the credential store, migrating the legacy file on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    
+    # Autocommit mode: single statements are atomic, transactions are explicit
+    conn = sqlite3.connect(CREDENTIALS_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS credentials ('
+        'user_id TEXT NOT NULL, '
+        'service TEXT NOT NULL, '
+        'data BLOB NOT NULL, '
+        'updated_at REAL NOT NULL, '
+        'key_id TEXT, '
+        'expires_at REAL, '
+        'lease_until REAL NOT NULL DEFAULT 0, '
+        'last_used_at REAL, '
+        'PRIMARY KEY (user_id, service))'
+    )
+    
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS credential_changes ('
+        'version INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'user_id TEXT NOT NULL, '
+        'service TEXT)'
+    )
+    
+    # Stores created by earlier versions lack the key rotation and token refresh columns
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(credentials)')]
+    for column, definition in (
+        ('key_id', 'TEXT'),
+        ('expires_at', 'REAL'),
+        ('lease_until', 'REAL NOT NULL DEFAULT 0'),
+        ('last_used_at', 'REAL')
+    ):
+        if column not in columns:
             try:
-                encrypted_data = f.read()
-                all_credentials = decrypt_data(encrypted_data)
-            except Exception as e:
-                print(f"Error reading credentials: {e}")
+                conn.execute(f'ALTER TABLE credentials ADD COLUMN {column} {definition}')
+            except sqlite3.OperationalError:
+                # Another worker added it first
+                pass
     
-    # Initialize user credentials if not exist
-    if user_id not in all_credentials:
-        all_credentials[user_id] = {}
+    # Existing records count as used when they were last saved
+    if 'last_used_at' not in columns:
+        conn.execute('UPDATE credentials SET last_used_at = updated_at WHERE last_used_at IS NULL')
     
-    # Save credentials for the service
-    all_credentials[user_id][service] = credentials
+    # The token refresher finds expiring records through this index without decrypting any
+    conn.execute('CREATE INDEX IF NOT EXISTS credentials_expiry ON credentials (service, expires_at)')
+    
+    _local.conn = conn
+    _local.pid = os.getpid()
+    
+    if migrate:
+        migrate_credentials_file(conn)
+    
+    return conn
+
+def migrate_credentials_file(conn=None):
+    """Move credentials from the legacy encrypted blob into per-record storage"""
+    if not os.path.exists(CREDENTIALS_FILE):
+        return 0
     
-    # Encrypt and save
-    encrypted_data = encrypt_data(all_credentials)
-    with open(CREDENTIALS_FILE, 'wb') as f:
-        f.write(encrypted_data)
+    # Called directly (as by migrate_credentials.py), opening the store must not migrate first
+    conn = conn or _connect(migrate=False)
+    migrated_file = f"{CREDENTIALS_FILE}.migrated"
+    
+    # The write lock makes sure only one process performs the migration
+    conn.execute('BEGIN IMMEDIATE')
+    renamed = False
+    try:
+        with open(CREDENTIALS_FILE, 'rb') as f:
+            all_credentials = decrypt_data(f.read())
+        
+        # Records written since the store went live take precedence
+        now = time.time()
+        records = [
+            (str(user_id), service, encrypt_data(credentials), now, PRIMARY_KEY_ID, now)
+            for user_id, services in all_credentials.items()
+            for service, credentials in services.items()
+        ]
+        conn.executemany(
+            'INSERT OR IGNORE INTO credentials (user_id, service, data, updated_at, key_id, last_used_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            records
+        )
+        
+        # Rename while still holding the lock so waiting workers find the file gone
+        os.replace(CREDENTIALS_FILE, migrated_file)
+        renamed = True
+        conn.execute('COMMIT')
+    except FileNotFoundError:
+        # Another worker migrated it while we waited for the lock
+        conn.execute('ROLLBACK')
+        return 0
+    except Exception as e:
+        conn.execute('ROLLBACK')
+        if renamed:
+            os.replace(migrated_file, CREDENTIALS_FILE)
+        print(f"Error migrating credentials: {e}")
+        return 0
+    
+    print(f"Migrated {len(records)} credential records to {CREDENTIALS_DB}")
+    
+    return len(records)
+
+def _record_change(conn, user_id, service=None):
+    """Log a write inside the caller's transaction so other processes invalidate the record"""
+    version = conn.execute(
+        'INSERT INTO credential_changes (user_id, service) VALUES (?, ?)',
+        (user_id, service)
+    ).lastrowid
+    conn.execute('DELETE FROM credential_changes WHERE version <= ?', (version - CREDENTIALS_CHANGE_LOG_SIZE,))
+
+def _check_store_version(conn):
+    """Drop cached records that other processes have changed since this process last looked"""
+    global _seen_version
+    
+    version = conn.execute('SELECT MAX(version) FROM credential_changes').fetchone()[0] or 0
+    with _version_lock:
+        # The cache starts empty, so the first version a process sees needs no invalidation
+        if _seen_version is None:
+            _seen_version = version
+            return
+        if version <= _seen_version:
+            return
+        
+        changes = conn.execute(
+            'SELECT version, user_id, service FROM credential_changes WHERE version > ? ORDER BY version',
+            (_seen_version,)
+        ).fetchall()
+        
+        # Entries pruned from the log could have named anything, so start over
+        if not changes or changes[0][0] != _seen_version + 1:
+            clear_credentials_cache()
+        else:
+            for _, user_id, service in changes:
+                _cache_invalidate(user_id, service)
+        
+        _seen_version = changes[-1][0] if changes else version
+
+def _cache_get(key):
+    """Return cached credentials for a key, or None when missing or expired"""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            _cache.move_to_end(key)
+            _cache_stats['hits'] += 1
+            return copy.deepcopy(entry[1])
+        
+        if entry:
+            del _cache[key]
+        _cache_stats['misses'] += 1
+    return None
+
+def _cache_put(key, credentials, generation):
+    """Cache decrypted credentials read at `generation`, evicting the least recently used entries"""
+    with _cache_lock:
+        # The record may have changed after it was read
+        if generation != _cache_generation:
+            return
+        _cache[key] = (time.monotonic() + CREDENTIALS_CACHE_TTL, copy.deepcopy(credentials))
+        _cache.move_to_end(key)
+        while len(_cache) > CREDENTIALS_CACHE_SIZE:
+            _cache.popitem(last=False)
+            _cache_stats['evictions'] += 1
+
+def _cache_invalidate(user_id, service=None):
+    """Drop cached credentials for a user, optionally for one service"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        for key in [key for key in _cache if key[0] == user_id and (service is None or key[1] == service)]:
+            del _cache[key]
+
+def clear_credentials_cache():
+    """Drop every cached credential"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        if _cache:
+            _cache_stats['invalidations'] += 1
+        _cache.clear()
+
+def get_credentials_cache_stats():
+    """Get hit/miss counters and sizing of the decrypted credential cache"""
+    with _cache_lock:
+        lookups = _cache_stats['hits'] + _cache_stats['misses']
+        return dict(
+            _cache_stats,
+            size=len(_cache),
+            max_size=CREDENTIALS_CACHE_SIZE,
+            ttl_seconds=CREDENTIALS_CACHE_TTL,
+            hit_rate=_cache_stats['hits'] / lookups if lookups else None
+        )
+
+def save_credentials(user_id, service, credentials, expires_at=None):
+    """Save encrypted credentials for a user and service
+    
+    expires_at is the token's expiry as a Unix timestamp. It is stored in the
+    clear so the token refresher can find expiring records without decrypting.
+    """
+    data = encrypt_data(credentials)
+    now = time.time()
+    conn = _connect()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(
+            'INSERT INTO credentials (user_id, service, data, updated_at, key_id, expires_at, last_used_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (user_id, service) DO UPDATE SET '
+            'data = excluded.data, updated_at = excluded.updated_at, key_id = excluded.key_id, '
+            'expires_at = excluded.expires_at',
+            (str(user_id), service, data, now, PRIMARY_KEY_ID, expires_at, now)
+        )
+        _record_change(conn, str(user_id), service)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    _cache_invalidate(str(user_id), service)
     
     return True
 
 def get_credentials(user_id, service):
     """Get decrypted credentials for a user and service"""
-    if not os.path.exists(CREDENTIALS_FILE):
-        return None
+    try:
+        conn = _connect()
+        _check_store_version(conn)
+        
+        key = (str(user_id), service)
+        credentials = _cache_get(key)
+        if credentials is not None:
+            return credentials
+        
+        generation = _cache_generation
+        row = conn.execute(
+            'SELECT data, key_id FROM credentials WHERE user_id = ? AND service = ?',
+            key
+        ).fetchone()
+        
+        if row:
+            credentials = decrypt_data(row[0])
+            
+            # Re-encrypt records still under an old key while we have them in hand
+            if row[1] != PRIMARY_KEY_ID:
+                _reencrypt_record(conn, key[0], key[1], row[0])
+            
+            _cache_put(key, credentials, generation)
+            return credentials
+    except Exception as e:
+        print(f"Error reading credentials: {e}")
+    
+    return None
+
+def mark_credentials_used(user_id, service):
+    """Record that a user's credentials served a request, at most once per CREDENTIALS_USE_RESOLUTION"""
+    key = (str(user_id), service)
+    now = time.time()
+    with _last_used_lock:
+        if now - _last_used.get(key, 0) < CREDENTIALS_USE_RESOLUTION:
+            return
+        _last_used[key] = now
+    
+    try:
+        _connect().execute(
+            'UPDATE credentials SET last_used_at = ? WHERE user_id = ? AND service = ?',
+            (now,) + key
+        )
+    except sqlite3.Error as e:
+        print(f"Error recording credential use: {e}")
+
+def _reencrypt_record(conn, user_id, service, data):
+    """Re-encrypt one record under the primary key unless it changed meanwhile"""
+    try:
+        # Compare-and-swap on the old ciphertext so a concurrent save always wins
+        cursor = conn.execute(
+            'UPDATE credentials SET data = ?, key_id = ? WHERE user_id = ? AND service = ? AND data = ?',
+            (cipher_suite.rotate(data), PRIMARY_KEY_ID, user_id, service, data)
+        )
+        return cursor.rowcount > 0
+    except (InvalidToken, sqlite3.Error) as e:
+        print(f"Error re-encrypting credentials for user {user_id}, service {service}: {e}")
+    
+    return False
+
+def rotate_credentials_batch(after=None, batch_size=CREDENTIALS_ROTATION_BATCH):
+    """Re-encrypt up to batch_size records not yet under the primary key
+    
+    Records are visited in key order starting after the (user_id, service) pair
+    `after`; returns the number re-encrypted and where to resume, or None when done.
+    """
+    conn = _connect()
+    query = 'SELECT user_id, service, data FROM credentials WHERE (key_id IS NULL OR key_id != ?)'
+    params = [PRIMARY_KEY_ID]
+    if after:
+        query += ' AND (user_id, service) > (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY user_id, service LIMIT ?'
+    params.append(batch_size)
+    
+    rows = conn.execute(query, params).fetchall()
+    if not rows:
+        return 0, None
+    
+    # One transaction per batch keeps the write lock short
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rotated = sum(_reencrypt_record(conn, user_id, service, data) for user_id, service, data in rows)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    
+    return rotated, (rows[-1][0], rows[-1][1])
+
+def get_rotation_status():
+    """Count records by whether they are encrypted under the primary key"""
+    conn = _connect()
+    pending = conn.execute(
+        'SELECT COUNT(*) FROM credentials WHERE key_id IS NULL OR key_id != ?',
+        (PRIMARY_KEY_ID,)
+    ).fetchone()[0]
+    total = conn.execute('SELECT COUNT(*) FROM credentials').fetchone()[0]
+    
+    return {
+        'primary_key_id': PRIMARY_KEY_ID,
+        'old_keys': len(ENCRYPTION_OLD_KEYS),
+        'records': total,
+        'pending': pending,
+        'rotating': bool(_rotation_thread and _rotation_thread.is_alive())
+    }
+
+def _rotation_loop(batch_size, interval):
+    """Re-encrypt the whole store in throttled batches, then exit"""
+    after = None
+    total = 0
+    try:
+        while True:
+            rotated, after = rotate_credentials_batch(after, batch_size)
+            total += rotated
+            if after is None:
+                break
+            time.sleep(interval)
+    except Exception as e:
+        print(f"Error rotating credentials: {e}")
+    
+    if total:
+        print(f"Re-encrypted {total} credential records under key {PRIMARY_KEY_ID}")
+
+def start_key_rotation(batch_size=CREDENTIALS_ROTATION_BATCH, interval=CREDENTIALS_ROTATION_INTERVAL):
+    """Start re-encrypting old records in a background thread, once per process"""
+    global _rotation_thread
     
-    with open(CREDENTIALS_FILE, 'rb') as f:
+    with _rotation_lock:
+        if _rotation_thread and _rotation_thread.is_alive():
+            return False
+        
+        _rotation_thread = threading.Thread(
+            target=_rotation_loop,
+            args=(batch_size, interval),
+            name='credential-key-rotation',
+            daemon=True
+        )
+        _rotation_thread.start()
+    
+    return True
+
+def iter_credentials(services=None, missing_expiry=False):
+    """Yield (user_id, service, credentials) for every stored record, ordered by user
+    
+    With missing_expiry=True only records saved without an expires_at are read.
+    """
+    conditions = []
+    params = ()
+    if services:
+        services = list(services)
+        conditions.append(f"service IN ({', '.join('?' * len(services))})")
+        params = tuple(services)
+    if missing_expiry:
+        conditions.append('expires_at IS NULL')
+    
+    query = 'SELECT user_id, service, data FROM credentials'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY user_id, service'
+    
+    # Each record is decrypted once, straight from the scan
+    for user_id, service, data in _connect().execute(query, params):
         try:
-            encrypted_data = f.read()
-            all_credentials = decrypt_data(encrypted_data)
-            
-            if user_id in all_credentials and service in all_credentials[user_id]:
-                return all_credentials[user_id][service]
+            yield user_id, service, decrypt_data(data)
         except Exception as e:
-            print(f"Error reading credentials: {e}")
+            print(f"Error decrypting credentials for user {user_id}, service {service}: {e}")
+
+def set_credentials_expiry(user_id, service, expires_at):
+    """Store the expiry of a record saved without one, unless a save has set it since"""
+    _connect().execute(
+        'UPDATE credentials SET expires_at = ? WHERE user_id = ? AND service = ? AND expires_at IS NULL',
+        (expires_at, str(user_id), service)
+    )
+
+def find_expiring_credentials(service, expires_before, used_since=None):
+    """List the users whose stored token for a service expires before a Unix timestamp
     
-    return None
+    Only the plaintext columns are read. Records leased by a refresh in any
+    process are left out, as are records last used before `used_since`.
+    """
+    query = 'SELECT user_id FROM credentials WHERE service = ? AND expires_at <= ? AND lease_until < ?'
+    params = [service, expires_before, time.time()]
+    if used_since is not None:
+        query += ' AND last_used_at >= ?'
+        params.append(used_since)
+    
+    return [row[0] for row in _connect().execute(query, params)]
+
+def lease_credentials(user_id, service, seconds):
+    """Claim a record for refreshing for `seconds`; False if another process holds it"""
+    now = time.time()
+    cursor = _connect().execute(
+        'UPDATE credentials SET lease_until = ? WHERE user_id = ? AND service = ? AND lease_until < ?',
+        (now + seconds, str(user_id), service, now)
+    )
+    return cursor.rowcount > 0
+
+def extend_credentials_lease(user_id, service, seconds):
+    """Hold a leased record for `seconds` from now, such as while a failed refresh backs off"""
+    _connect().execute(
+        'UPDATE credentials SET lease_until = ? WHERE user_id = ? AND service = ?',
+        (time.time() + seconds, str(user_id), service)
+    )
 
 def delete_credentials(user_id, service=None):
     """Delete credentials for a user, optionally for a specific service"""
-    if not os.path.exists(CREDENTIALS_FILE):
-        return False
-    
-    with open(CREDENTIALS_FILE, 'rb') as f:
+    try:
+        conn = _connect()
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            encrypted_data = f.read()
-            all_credentials = decrypt_data(encrypted_data)
-            
-            if user_id in all_credentials:
-                if service:
-                    if service in all_credentials[user_id]:
-                        del all_credentials[user_id][service]
-                else:
-                    del all_credentials[user_id]
-                
-                # Encrypt and save
-                encrypted_data = encrypt_data(all_credentials)
-                with open(CREDENTIALS_FILE, 'wb') as f:
-                    f.write(encrypted_data)
-                
-                return True
-        except Exception as e:
-            print(f"Error deleting credentials: {e}")
+            if service:
+                cursor = conn.execute(
+                    'DELETE FROM credentials WHERE user_id = ? AND service = ?',
+                    (str(user_id), service)
+                )
+            else:
+                cursor = conn.execute('DELETE FROM credentials WHERE user_id = ?', (str(user_id),))
+            _record_change(conn, str(user_id), service)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        _cache_invalidate(str(user_id), service)
+        
+        return cursor.rowcount > 0
+    except Exception as e:
+        print(f"Error deleting credentials: {e}")
     
     return False 
\ No newline at end of file
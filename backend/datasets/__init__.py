@@ -0,0 +1 @@
+# Datasets package initialization
\ No newline at end of file
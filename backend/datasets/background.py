@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import threading
+
+# Root of the dataset store. It lives here rather than in datasets.store so job
+# modules can place their files under it without loading the database models.
+DATASET_DIR = os.getenv(
+    'DATASET_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'datasets')
+)
+
+# Job status, result and upload files untouched for this many seconds are removed
+JOB_FILE_TTL = float(os.getenv('JOB_FILE_TTL', str(7 * 86400)))
+
+# A job directory is scanned for expired files at most this often per process
+JOB_CLEANUP_INTERVAL = 3600
+
+# Executors shared by every thread of this process, by name
+_executors = {}
+_executors_lock = threading.Lock()
+
+def shared_executor(name, factory):
+    """Get the process-wide executor registered under `name`, creating it with factory() on first use"""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = factory()
+        return _executors[name]
+
+def discard_executor(name, executor):
+    """Forget a broken executor so the next shared_executor() call builds a fresh one"""
+    with _executors_lock:
+        # Another thread may already have replaced it
+        if _executors.get(name) is executor:
+            del _executors[name]
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# directory -> when this process last scanned it
+_last_cleanup = {}
+_cleanup_lock = threading.Lock()
+
+def cleanup_job_files(directory, ttl=None):
+    """Remove files in a job directory not modified for `ttl` seconds, returning how many went
+    
+    Running jobs keep touching their status file, so only finished or abandoned
+    jobs expire. The scan runs at most once per JOB_CLEANUP_INTERVAL.
+    """
+    ttl = JOB_FILE_TTL if ttl is None else ttl
+    now = time.time()
+    with _cleanup_lock:
+        if now - _last_cleanup.get(directory, 0) < JOB_CLEANUP_INTERVAL:
+            return 0
+        _last_cleanup[directory] = now
+    
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    
+    for entry in entries:
+        try:
+            if entry.is_file() and now - entry.stat().st_mtime > ttl:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            # Another worker removed it first
+            pass
+    
+    return removed
+
+def _status_path(directory, job_id):
+    return os.path.join(directory, f"{job_id}.json")
+
+def read_job_status(directory, job_id):
+    """Read the status file of a job in `directory`, or None if the job does not exist"""
+    try:
+        with open(_status_path(directory, job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_job_status(directory, job_id, **fields):
+    """Merge fields into the status file of a job in `directory`"""
+    status = read_job_status(directory, job_id) or {'id': job_id, 'created_at': time.time()}
+    status.update(fields, updated_at=time.time())
+    
+    # Status files are shared by every API worker, so replace them atomically
+    os.makedirs(directory, exist_ok=True)
+    path = _status_path(directory, job_id)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+    
+    return status
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+def lttb_indices(y, n_out, x=None):
+    """Select `n_out` point indices with Largest-Triangle-Three-Buckets"""
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    x = np.arange(n, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    
+    # Split the interior points into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:n - 1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:n - 1], edges[:-1]) / counts
+    
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    
+    previous = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        
+        # Third triangle vertex is the next bucket's average (or the last point)
+        if i + 1 < n_out - 2:
+            next_x, next_y = avg_x[i + 1], avg_y[i + 1]
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        
+        # Pick the point forming the largest triangle with its neighbours
+        prev_x, prev_y = x[previous], y[previous]
+        areas = np.abs(
+            (prev_x - next_x) * (y[start:end] - prev_y)
+            - (prev_x - x[start:end]) * (next_y - prev_y)
+        )
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    
+    return selected
+
+def min_max_indices(y, n_out):
+    """Select the minimum and maximum point of each bucket, keeping order"""
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    
+    buckets = n_out // 2
+    bucket_ids = (np.arange(n) * buckets) // n
+    
+    # Sorting by (bucket, value) puts each bucket's min first and max last
+    order = np.lexsort((y, bucket_ids))
+    starts = np.searchsorted(bucket_ids[order], np.arange(buckets))
+    ends = np.append(starts[1:], n) - 1
+    
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+def method_for_chart(chart_type):
+    """Pick the downsampling method that preserves a chart type's shape"""
+    return 'minmax' if chart_type == 'bar' else 'lttb'
+
+def downsample_indices(y, max_points, method='lttb', x=None):
+    """Select at most `max_points` indices of a series"""
+    if method == 'minmax':
+        return min_max_indices(y, max_points)
+    return lttb_indices(y, max_points, x=x)
+
+def downsample_frame(df, max_points, chart_type='line', x_column='label', y_column='value'):
+    """Downsample a label/value DataFrame to at most `max_points` rows"""
+    if not max_points or len(df) <= max_points:
+        return df
+    
+    # Numeric and datetime labels give real x distances, others are positional
+    x = None
+    if x_column in df.columns:
+        labels = df[x_column]
+        if pd.api.types.is_datetime64_any_dtype(labels):
+            x = labels.astype('int64').to_numpy()
+        elif pd.api.types.is_numeric_dtype(labels):
+            x = labels.to_numpy()
+    
+    indices = downsample_indices(
+        df[y_column].to_numpy(),
+        max_points,
+        method=method_for_chart(chart_type),
+        x=x
+    )
+    return df.iloc[indices]
@@ -0,0 +1,105 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+from datasets.formats import format_dates
+
+# String columns with at most this share of distinct values become categoricals
+CATEGORY_MAX_RATIO = float(os.getenv('UPLOAD_CATEGORY_MAX_RATIO', '0.5'))
+
+# Number of values checked before trying to parse a column as dates
+DATE_SAMPLE_SIZE = 100
+
+# ISO dates and timestamps accepted by the date detector (2023-01-31, 2023-01-31T08:30:00); other
+# shapes such as 01/02/2023 are ambiguous and would not render back as uploaded
+DATE_PATTERN = r'\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}:\d{2})?'
+
+def _downcast_integers(series):
+    """Downcast an integer series to the smallest width holding its range"""
+    if series.empty:
+        return series
+    downcast = 'unsigned' if series.min() >= 0 else 'integer'
+    return pd.to_numeric(series, downcast=downcast)
+
+def _downcast_floats(series):
+    """Turn whole-number floats into integers and floats into float32 when lossless"""
+    values = series.to_numpy()
+    
+    # Whole numbers without nulls (such as the coerced value column) become integers
+    if not series.isna().any() and np.isfinite(values).all() and np.array_equal(values, np.trunc(values)):
+        return _downcast_integers(series.astype(np.int64))
+    
+    # Only use float32 when every value survives the round trip unchanged
+    as_float32 = values.astype(np.float32)
+    if np.array_equal(as_float32.astype(np.float64), values, equal_nan=True):
+        return pd.Series(as_float32, index=series.index, name=series.name)
+    
+    return series
+
+def _parse_dates(series):
+    """Parse a string column as datetime64 if every value is a date, else None"""
+    sample = series.dropna().head(DATE_SAMPLE_SIZE).astype(str)
+    
+    # Require a full ISO shape so codes like "12-3" are never read as dates
+    if sample.empty or not sample.str.fullmatch(DATE_PATTERN).all():
+        return None
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if pd.to_datetime(sample, errors='coerce').isna().any():
+            return None
+        parsed = pd.to_datetime(series, errors='coerce')
+    
+    # Any value that failed to parse means this is not really a date column
+    if parsed.isna().sum() != series.isna().sum():
+        return None
+    
+    # Records responses render dates back as text, so they must come out exactly as uploaded
+    present = series.notna()
+    rendered = format_dates(parsed.to_frame('value'))['value']
+    if not (rendered[present] == series[present].astype(str)).all():
+        return None
+    
+    return parsed
+
+def optimize_frame(df, category_max_ratio=CATEGORY_MAX_RATIO):
+    """Shrink a DataFrame's dtypes and report per-column memory before and after"""
+    before = df.memory_usage(index=False, deep=True)
+    dtypes_before = df.dtypes.astype(str)
+    
+    optimized = {}
+    for column in df.columns:
+        series = df[column]
+        
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        elif pd.api.types.is_integer_dtype(series):
+            optimized[column] = _downcast_integers(series)
+        elif pd.api.types.is_float_dtype(series):
+            optimized[column] = _downcast_floats(series)
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            parsed = _parse_dates(series)
+            if parsed is not None:
+                optimized[column] = parsed
+            elif len(series) and series.nunique(dropna=True) <= category_max_ratio * len(series):
+                optimized[column] = series.astype('category')
+    
+    if optimized:
+        df = df.assign(**optimized)
+    
+    after = df.memory_usage(index=False, deep=True)
+    memory = {
+        'bytes_before': int(before.sum()),
+        'bytes_after': int(after.sum()),
+        'columns': {
+            str(column): {
+                'dtype_before': dtypes_before[column],
+                'dtype_after': str(df[column].dtype),
+                'bytes_before': int(before[column]),
+                'bytes_after': int(after[column])
+            }
+            for column in df.columns
+        }
+    }
+    
+    return df, memory
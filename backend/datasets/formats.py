@@ -0,0 +1,118 @@
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+from flask import Response, jsonify
+
+# Media types the dataset endpoints can respond with
+RECORDS_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.reportvibe.columnar+json'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+
+# Short names accepted in the ?format= query parameter
+FORMATS = {
+    'records': RECORDS_MIMETYPE,
+    'columnar': COLUMNAR_MIMETYPE,
+    'arrow': ARROW_MIMETYPE
+}
+
+def negotiate_format(request):
+    """Pick the response format from ?format= or the Accept header"""
+    name = request.args.get('format')
+    if name in FORMATS:
+        return name
+    
+    # Records stay the default for */* and plain application/json clients
+    mimetype = request.accept_mimetypes.best_match(
+        [RECORDS_MIMETYPE, COLUMNAR_MIMETYPE, ARROW_MIMETYPE],
+        default=RECORDS_MIMETYPE
+    )
+    return next(key for key, value in FORMATS.items() if value == mimetype)
+
+def format_dates(df):
+    """Render datetime columns as ISO date strings for JSON clients"""
+    converted = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            # Midnight-only columns keep the plain date they were uploaded as
+            values = series.dropna()
+            fmt = '%Y-%m-%d' if (values == values.dt.normalize()).all() else '%Y-%m-%dT%H:%M:%S'
+            converted[column] = series.dt.strftime(fmt)
+    
+    return df.assign(**converted) if converted else df
+
+def frame_to_columnar_json(df):
+    """Serialize a DataFrame as {"columns": [...], "data": {column: [...]}}"""
+    df = format_dates(df)
+    
+    # Each column is encoded by pandas' C JSON writer, never row by row
+    data = ','.join(
+        f"{json.dumps(str(column))}:{df[column].to_json(orient='values', date_format='iso')}"
+        for column in df.columns
+    )
+    return f'{{"columns":{json.dumps([str(column) for column in df.columns], separators=(",", ":"))},"data":{{{data}}}}}'
+
+def table_to_arrow_ipc(table):
+    """Serialize a pyarrow Table as an Apache Arrow IPC stream"""
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    
+    return sink.getvalue()
+
+def frame_to_arrow_ipc(df):
+    """Serialize a DataFrame as an Apache Arrow IPC stream"""
+    return table_to_arrow_ipc(pa.Table.from_pandas(df, preserve_index=False))
+
+def frame_response(df, fmt='records'):
+    """Build a Flask response for a DataFrame in the negotiated format"""
+    if fmt == 'columnar':
+        return Response(frame_to_columnar_json(df), mimetype=COLUMNAR_MIMETYPE)
+    if fmt == 'arrow':
+        return Response(frame_to_arrow_ipc(df), mimetype=ARROW_MIMETYPE)
+    
+    # Convert DataFrame to list of dictionaries
+    return jsonify(format_dates(df).to_dict('records'))
+
+def _frame_to_ndjson(df):
+    """Serialize a DataFrame as newline-delimited JSON records"""
+    if df.empty:
+        return ''
+    
+    lines = df.to_json(orient='records', lines=True)
+    
+    # Older pandas versions omit the trailing newline
+    if not lines.endswith('\n'):
+        lines += '\n'
+    
+    return lines
+
+def iter_ndjson(frames):
+    """Yield NDJSON text for each DataFrame in `frames`"""
+    for df in frames:
+        lines = _frame_to_ndjson(df)
+        if lines:
+            yield lines
+
+def iter_ndjson_records(records):
+    """Yield one NDJSON line for each dict in `records`"""
+    for record in records:
+        yield json.dumps(record, default=str) + '\n'
+
+def iter_json_array(frames):
+    """Yield a single JSON array of records built chunk by chunk from `frames`"""
+    yield '['
+    
+    first = True
+    for df in frames:
+        if df.empty:
+            continue
+        
+        # Strip the brackets so chunks can be joined into one array
+        records = df.to_json(orient='records')[1:-1]
+        
+        yield records if first else ',' + records
+        first = False
+    
+    yield ']'
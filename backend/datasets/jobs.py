@@ -0,0 +1,180 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datasets.parsing import (
+    peek_stream, detect_dialect, iter_csv_chunks, concat_chunks, prepare_chart_frame,
+    open_decompressed
+)
+from datasets.dtypes import optimize_frame
+from datasets.stats import compute_column_stats
+from datasets.store import write_frame, write_stats, register_dataset
+from datasets import background
+from datasets.background import DATASET_DIR, shared_executor
+
+logger = logging.getLogger(__name__)
+
+# Worker processes parsing uploads in the background
+INGEST_MAX_WORKERS = int(os.getenv('INGEST_MAX_WORKERS', '2'))
+
+# Jobs allowed to be queued or running at once in this API process
+INGEST_MAX_PENDING = int(os.getenv('INGEST_MAX_PENDING', '8'))
+
+# Workers start from a clean server process rather than a fork of this multithreaded one,
+# which could inherit locks held by request, rotation or refresher threads
+INGEST_START_METHOD = os.getenv('INGEST_START_METHOD', 'forkserver')
+
+# Scheduling priority adjustment for worker processes
+INGEST_NICENESS = int(os.getenv('INGEST_NICENESS', '10'))
+
+# Directory holding job status files and spooled uploads
+JOB_DIR = os.path.join(DATASET_DIR, 'jobs')
+
+_slots = threading.BoundedSemaphore(INGEST_MAX_PENDING)
+
+def _init_worker():
+    """Lower worker priority so parsing never starves the API processes"""
+    try:
+        os.nice(INGEST_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+def _get_executor():
+    """Get the shared ingestion process pool, creating it on first use"""
+    return shared_executor('ingest', lambda: ProcessPoolExecutor(
+        max_workers=INGEST_MAX_WORKERS,
+        mp_context=multiprocessing.get_context(INGEST_START_METHOD),
+        initializer=_init_worker
+    ))
+
+def _upload_path(job_id):
+    return os.path.join(JOB_DIR, f"{job_id}.upload")
+
+def read_job_status(job_id):
+    """Read an ingestion job's status, or None if the job does not exist"""
+    return background.read_job_status(JOB_DIR, job_id)
+
+def write_job_status(job_id, **fields):
+    """Merge fields into an ingestion job's status file"""
+    return background.write_job_status(JOB_DIR, job_id, **fields)
+
+def reserve_slot():
+    """Reserve a job slot, returning False when ingestion is saturated"""
+    return _slots.acquire(blocking=False)
+
+def release_slot():
+    _slots.release()
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+def spool_upload(job_id, stream, block_size=1024 * 1024):
+    """Copy an upload to the job directory, returning (path, sha256 hex digest, size)"""
+    os.makedirs(JOB_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    
+    path = _upload_path(job_id)
+    with open(path, 'wb') as f:
+        for block in iter(lambda: stream.read(block_size), b''):
+            digest.update(block)
+            f.write(block)
+            size += len(block)
+    
+    return path, digest.hexdigest(), size
+
+def discard_upload(job_id):
+    """Remove a job's spooled upload"""
+    try:
+        os.remove(_upload_path(job_id))
+    except OSError:
+        pass
+
+def _ingest_worker(job_id, path, content_hash, compression=None):
+    """Parse a spooled upload into the dataset store (runs in a worker process)"""
+    write_job_status(job_id, state='running')
+    
+    # Progress is tracked on the spooled (possibly compressed) bytes
+    with open(path, 'rb') as f:
+        sample, stream = peek_stream(open_decompressed(f, compression))
+        dialect = detect_dialect(sample)
+        
+        chunks = []
+        rows = 0
+        started = time.perf_counter()
+        for chunk in iter_csv_chunks(stream, dialect):
+            chunks.append(chunk)
+            rows += len(chunk)
+            write_job_status(job_id, bytes_processed=f.tell(), rows_parsed=rows)
+    
+    df = concat_chunks(chunks)
+    if len(df.columns) < 2:
+        raise ValueError('CSV file must have at least two columns')
+    
+    columns = df.columns.tolist()
+    df = prepare_chart_frame(df)
+    df, memory = optimize_frame(df)
+    write_frame(content_hash, df)
+    write_stats(content_hash, compute_column_stats(df))
+    
+    report = {
+        'dialect': {key: dialect[key] for key in ('delimiter', 'quotechar', 'header', 'encoding')},
+        'engine': 'c',
+        'parse_ms': round((time.perf_counter() - started) * 1000, 2),
+        'memory': memory
+    }
+    return {'rows': len(df), 'columns': [str(column) for column in columns], 'report': report}
+
+def _finish_job(app, job_id, user_id, filename, content_hash, size_bytes, executor, future):
+    """Record the dataset of a finished job and release its slot"""
+    try:
+        result = future.result()
+        with app.app_context():
+            register_dataset(
+                user_id, content_hash, filename, size_bytes,
+                result['rows'], result['columns'], result['report']
+            )
+        write_job_status(job_id, state='completed', rows_parsed=result['rows'],
+                         bytes_processed=size_bytes, dataset_id=content_hash)
+        logger.info(f"Ingestion job {job_id} completed: {filename} ({result['rows']} rows)")
+    except BrokenProcessPool:
+        # Every job queued on the pool ends up here, so each is marked failed; later uploads get a new pool
+        background.discard_executor('ingest', executor)
+        logger.error(f"Ingestion job {job_id} failed: a worker process terminated abruptly")
+        write_job_status(job_id, state='failed', error='A worker process terminated abruptly, possibly out of memory')
+    except Exception as e:
+        logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+        write_job_status(job_id, state='failed', error=str(e))
+    finally:
+        release_slot()
+        discard_upload(job_id)
+
+def submit_ingest(app, job_id, user_id, filename, path, content_hash, size_bytes, compression=None):
+    """Queue a spooled upload for background parsing"""
+    background.cleanup_job_files(JOB_DIR)
+    write_job_status(
+        job_id, state='queued', user_id=user_id, filename=filename,
+        bytes_total=size_bytes, bytes_processed=0, rows_parsed=0,
+        dataset_id=None, error=None
+    )
+    
+    # A worker killed mid-job breaks the whole pool, so replace it once before giving up
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            future = executor.submit(_ingest_worker, job_id, path, content_hash, compression)
+            break
+        except BrokenProcessPool as e:
+            background.discard_executor('ingest', executor)
+            if attempt:
+                write_job_status(job_id, state='failed', error=str(e))
+                raise
+    
+    future.add_done_callback(
+        lambda f: _finish_job(app, job_id, user_id, filename, content_hash, size_bytes, executor, f)
+    )
@@ -0,0 +1,406 @@
+import os
+import io
+import csv
+import bz2
+import gzip
+import time
+import tempfile
+import pandas as pd
+
+# Number of rows parsed per chunk when streaming an upload
+CHUNK_ROWS = int(os.getenv('UPLOAD_CHUNK_ROWS', '50000'))
+
+# Number of bytes sampled from the start of an upload for dialect detection
+SAMPLE_BYTES = int(os.getenv('UPLOAD_SAMPLE_BYTES', '16384'))
+
+# Forward-only input larger than this is spooled to disk so a failed parse can be retried
+PARSE_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Delimiters considered by the dialect detector
+DELIMITERS = ',;\t|'
+
+# Accepted upload file names and their compression
+UPLOAD_SUFFIXES = {
+    '.csv': None,
+    '.csv.gz': 'gzip',
+    '.csv.bz2': 'bz2',
+    '.csv.zst': 'zstd'
+}
+
+class PeekedStream(io.RawIOBase):
+    """Binary stream that replays an already-read prefix before the rest of a stream"""
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            size = min(len(buffer), len(self._prefix))
+            buffer[:size] = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+            return size
+        
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+class RecordingStream(io.RawIOBase):
+    """Binary stream that keeps a copy of everything read through it, so it can be replayed"""
+    def __init__(self, stream):
+        self._stream = stream
+        self.recorded = io.BytesIO()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self.recorded.write(data)
+        return len(data)
+
+def compression_for(filename, content_encoding=None):
+    """Return the compression of an upload, or None for plain CSV"""
+    if content_encoding and content_encoding.lower() in ('gzip', 'x-gzip'):
+        return 'gzip'
+    
+    for suffix, compression in UPLOAD_SUFFIXES.items():
+        if compression and filename.lower().endswith(suffix):
+            return compression
+    return None
+
+def is_supported_upload(filename):
+    """Check whether an upload file name has an accepted CSV suffix"""
+    return filename.lower().endswith(tuple(UPLOAD_SUFFIXES))
+
+def _decompressor(stream, compression):
+    """Open a decompressing reader over a stream, leaving the stream open when it is closed"""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(stream, mode='rb')
+    if compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(stream, closefd=False)
+    raise ValueError(f"Unsupported compression: {compression}")
+
+class DecompressedStream(io.RawIOBase):
+    """Decompressed view of a stream; seeking re-opens the decompressor over a seekable source"""
+    def __init__(self, stream, compression):
+        self._stream = stream
+        self._compression = compression
+        self._start = stream.tell() if hasattr(stream, 'seekable') and stream.seekable() else None
+        self._reader = _decompressor(stream, compression)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self._start is not None
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, buffer):
+        data = self._reader.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if not self.seekable():
+            raise io.UnsupportedOperation('seek')
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('seek from end')
+        
+        # Compressed data can only be read forwards, so going back starts over from the source
+        if offset < self._position:
+            self._stream.seek(self._start)
+            self._reader = _decompressor(self._stream, self._compression)
+            self._position = 0
+        while self._position < offset:
+            skipped = self._reader.read(min(offset - self._position, 1024 * 1024))
+            if not skipped:
+                break
+            self._position += len(skipped)
+        
+        return self._position
+
+def open_decompressed(stream, compression):
+    """Wrap a stream so it is decompressed incrementally while being read"""
+    if not compression:
+        return stream
+    
+    # Over a seekable source (spooled uploads) the result can be rewound to parse it again
+    return io.BufferedReader(DecompressedStream(stream, compression))
+
+def peek_stream(stream, size=SAMPLE_BYTES):
+    """Read a sample from the start of a stream without consuming it"""
+    # Seekable streams (spooled multipart files) are simply rewound
+    if hasattr(stream, 'seekable') and stream.seekable():
+        position = stream.tell()
+        sample = stream.read(size)
+        stream.seek(position)
+        return sample, stream
+    
+    sample = stream.read(size)
+    return sample, io.BufferedReader(PeekedStream(sample, stream))
+
+def _detect_encoding(sample):
+    """Guess the text encoding of a byte sample"""
+    if sample.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    if sample.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'
+    
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is still UTF-8
+        if e.start < len(sample) - 3:
+            return 'latin-1'
+    
+    return 'utf-8'
+
+def _looks_numeric(value):
+    """Check whether a CSV cell looks like a number"""
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+def detect_dialect(sample):
+    """Detect delimiter, quoting, header and encoding from a byte sample"""
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+    
+    # Drop the last line when the sample ends mid-row
+    if len(sample) >= SAMPLE_BYTES and '\n' in text:
+        text = text[:text.rindex('\n')]
+    
+    try:
+        sniffed = csv.Sniffer().sniff(text, delimiters=DELIMITERS)
+        delimiter, quotechar = sniffed.delimiter, sniffed.quotechar or '"'
+    except csv.Error:
+        # Fall back to the candidate that appears most often in the first line
+        first_line = text.split('\n', 1)[0]
+        delimiter = max(DELIMITERS, key=first_line.count) if first_line else ','
+        if first_line.count(delimiter) == 0:
+            delimiter = ','
+        quotechar = '"'
+    
+    # Treat the first row as a header unless it is entirely numeric
+    first_row = next(csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar), [])
+    header = not first_row or not all(_looks_numeric(cell) for cell in first_row if cell.strip())
+    
+    return {
+        'delimiter': delimiter,
+        'quotechar': quotechar,
+        'header': header,
+        'encoding': encoding,
+        'columns': len(first_row)
+    }
+
+def pyarrow_engine_available():
+    """Check whether the pyarrow CSV reader is installed"""
+    try:
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _read_csv_kwargs(dialect):
+    """Build pandas.read_csv arguments for a detected dialect"""
+    kwargs = {
+        'sep': dialect['delimiter'],
+        'quotechar': dialect['quotechar'],
+        'encoding': dialect['encoding']
+    }
+    
+    # Give headerless files stable string column names
+    if not dialect['header']:
+        kwargs['header'] = None
+        kwargs['names'] = [f"column_{i + 1}" for i in range(dialect['columns'])]
+    
+    return kwargs
+
+def _sample_dtypes(sample, dialect):
+    """Infer explicit string and float column dtypes from the sample"""
+    try:
+        text = sample.decode(dialect['encoding'], errors='ignore')
+        if len(sample) >= SAMPLE_BYTES and '\n' in text:
+            text = text[:text.rindex('\n')]
+        df = pd.read_csv(io.StringIO(text), **dict(_read_csv_kwargs(dialect), encoding=None))
+    except Exception:
+        return {}
+    
+    dtypes = {}
+    for i, column in enumerate(df.columns):
+        # The value column is coerced separately, so leave it to the parser
+        if i == 1:
+            continue
+        if pd.api.types.is_float_dtype(df[column]):
+            dtypes[column] = 'float64'
+        elif not pd.api.types.is_numeric_dtype(df[column]):
+            dtypes[column] = 'object'
+    
+    return dtypes
+
+def _read_with_pyarrow(stream, dialect, dtypes):
+    """Parse a CSV stream with the multi-threaded pyarrow reader"""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    
+    read_options = pa_csv.ReadOptions(encoding=dialect['encoding'])
+    if not dialect['header']:
+        read_options.column_names = _read_csv_kwargs(dialect)['names']
+    
+    # String columns stay strings, so dates are not silently turned into timestamps
+    column_types = {
+        column: pa.string() if dtype == 'object' else pa.float64()
+        for column, dtype in dtypes.items()
+    }
+    
+    table = pa_csv.read_csv(
+        stream,
+        read_options=read_options,
+        parse_options=pa_csv.ParseOptions(
+            delimiter=dialect['delimiter'],
+            quote_char=dialect['quotechar']
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            strings_can_be_null=True
+        )
+    )
+    return table.to_pandas()
+
+def _seekable(stream, block_size=1024 * 1024):
+    """Return the stream itself if it can be rewound, else a spooled copy of it"""
+    if hasattr(stream, 'seekable') and stream.seekable():
+        return stream
+    
+    spooled = tempfile.SpooledTemporaryFile(max_size=PARSE_SPOOL_MAX_BYTES)
+    for block in iter(lambda: stream.read(block_size), b''):
+        spooled.write(block)
+    spooled.seek(0)
+    
+    return spooled
+
+def read_csv_frame(stream, engine=None):
+    """Detect the dialect of a CSV stream and parse it in a single pass"""
+    # Sampled dtypes may not hold for the whole file, so keep a way to re-read it
+    stream = _seekable(stream)
+    start = stream.tell()
+    sample, stream = peek_stream(stream)
+    dialect = detect_dialect(sample)
+    dtypes = _sample_dtypes(sample, dialect)
+    
+    if engine is None or engine == 'auto':
+        engine = 'pyarrow' if pyarrow_engine_available() else 'c'
+    
+    started = time.perf_counter()
+    try:
+        if engine == 'pyarrow':
+            df = _read_with_pyarrow(stream, dialect, dtypes)
+        else:
+            df = pd.read_csv(stream, engine='c', dtype=dtypes or None, **_read_csv_kwargs(dialect))
+    except (ValueError, pd.errors.ParserError):
+        # An explicit dtype from the sample did not hold for the whole file
+        stream.seek(start)
+        engine = 'c'
+        df = pd.read_csv(stream, engine='c', **_read_csv_kwargs(dialect))
+    
+    report = {
+        'dialect': {key: dialect[key] for key in ('delimiter', 'quotechar', 'header', 'encoding')},
+        'engine': engine,
+        'parse_ms': round((time.perf_counter() - started) * 1000, 2)
+    }
+    
+    return df, report
+
+def _chunk_dtypes(chunk):
+    """Map a parsed chunk's columns to dtypes later chunks can be read with, missing values included"""
+    dtypes = {}
+    for column in chunk.columns:
+        series = chunk[column]
+        if pd.api.types.is_bool_dtype(series):
+            dtypes[column] = 'boolean'
+        elif pd.api.types.is_integer_dtype(series):
+            dtypes[column] = 'Int64'
+        elif pd.api.types.is_float_dtype(series):
+            dtypes[column] = 'float64'
+        else:
+            dtypes[column] = 'object'
+    
+    return dtypes
+
+def iter_csv_chunks(stream, dialect=None, chunksize=CHUNK_ROWS, fixed_dtypes=False):
+    """Parse a CSV stream into DataFrames of at most `chunksize` rows
+    
+    Each chunk infers its own dtypes unless fixed_dtypes=True. In that case the
+    dtypes of the first chunk are passed as dtype= for the whole file. A later
+    value that does not fit them raises ValueError.
+    """
+    if dialect is None:
+        sample, stream = peek_stream(stream)
+        dialect = detect_dialect(sample)
+    
+    # The pyarrow engine cannot read in chunks, so streaming uses the C engine
+    kwargs = dict(_read_csv_kwargs(dialect), engine='c', chunksize=chunksize)
+    if fixed_dtypes:
+        # Infer dtypes from the first chunk, then parse again from the start with them pinned,
+        # replaying the bytes the first reader consumed; the first chunk is re-read, nothing more
+        recording = RecordingStream(stream)
+        with pd.read_csv(io.BufferedReader(recording), **kwargs) as reader:
+            first_chunk = next(reader, None)
+        if first_chunk is None:
+            return
+        
+        stream = io.BufferedReader(PeekedStream(recording.recorded.getvalue(), stream))
+        kwargs['dtype'] = _chunk_dtypes(first_chunk)
+    
+    reader = pd.read_csv(stream, **kwargs)
+    try:
+        for chunk in reader:
+            yield chunk
+    except TypeError as e:
+        # Nullable integer columns reject fractions with TypeError rather than ValueError
+        raise ValueError(str(e)) from e
+    finally:
+        reader.close()
+
+def concat_chunks(chunks):
+    """Concatenate parsed chunks, reading columns as text where chunks disagree"""
+    if not chunks:
+        return pd.DataFrame()
+    
+    # A column that is numeric in some chunks and text in others is kept as text
+    for column in chunks[0].columns:
+        numeric = [pd.api.types.is_numeric_dtype(chunk[column]) for chunk in chunks]
+        if any(numeric) and not all(numeric):
+            for chunk, is_numeric in zip(chunks, numeric):
+                if is_numeric:
+                    chunk[column] = chunk[column].astype(str).where(chunk[column].notna())
+    
+    return pd.concat(chunks, ignore_index=True)
+
+def prepare_chart_frame(df):
+    """Rename the first two columns to label/value and coerce value to numeric"""
+    # For charting purposes, first column is 'label' and second is 'value'
+    chart_columns = df.columns.tolist()
+    chart_columns[0] = 'label'
+    chart_columns[1] = 'value'
+    df.columns = chart_columns
+    
+    # Ensure value column is numeric
+    df['value'] = pd.to_numeric(df['value'], errors='coerce').fillna(0)
+    
+    return df
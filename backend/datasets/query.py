@@ -0,0 +1,188 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+import pandas as pd
+from datasets.store import read_frame
+
+# Maximum number of query results kept in memory
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '256'))
+
+FILTER_OPS = {
+    'eq': lambda s, v: s == v,
+    'ne': lambda s, v: s != v,
+    'gt': lambda s, v: s > v,
+    'gte': lambda s, v: s >= v,
+    'lt': lambda s, v: s < v,
+    'lte': lambda s, v: s <= v,
+    'in': lambda s, v: s.isin(v),
+    'not_in': lambda s, v: ~s.isin(v),
+    'between': lambda s, v: s.between(v[0], v[1]),
+    'contains': lambda s, v: s.astype(str).str.contains(str(v), case=False, regex=False, na=False),
+    'is_null': lambda s, v: s.isna(),
+    'not_null': lambda s, v: s.notna()
+}
+
+AGGREGATES = ('sum', 'mean', 'median', 'min', 'max', 'count', 'nunique')
+
+# pandas period aliases for each time bucket
+TIME_BUCKETS = {
+    'day': 'D',
+    'week': 'W',
+    'month': 'M',
+    'quarter': 'Q',
+    'year': 'Y'
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _column_resolver(dataset, stored_columns):
+    """Map original and chart column names to stored Parquet columns"""
+    names = {column: column for column in stored_columns}
+    names.update(zip(dataset.columns, stored_columns))
+    
+    def resolve(name):
+        if name not in names:
+            raise ValueError(f"Unknown column: {name}")
+        return names[name]
+    
+    return resolve
+
+def _referenced_columns(spec, stored_columns):
+    """List every stored column a query spec refers to"""
+    columns = [f['column'] for f in spec.get('filters', [])]
+    columns += list(spec.get('group_by', []))
+    columns += [a['column'] for a in spec.get('aggregates', [])]
+    columns += list(spec.get('columns', []))
+    if spec.get('time_bucket'):
+        columns.append(spec['time_bucket']['column'])
+    columns += [s['column'] for s in spec.get('sort', []) if s['column'] in stored_columns]
+    return list(dict.fromkeys(columns))
+
+def _coerce_filter_value(series, value):
+    """Convert filter values to timestamps when filtering datetime columns"""
+    if pd.api.types.is_datetime64_any_dtype(series) and value is not None:
+        if isinstance(value, list):
+            return [pd.Timestamp(v) for v in value]
+        return pd.Timestamp(value)
+    return value
+
+def _run(df, spec):
+    """Apply filters, time bucketing, grouping, sorting and limits to a DataFrame"""
+    # Filters are combined into a single boolean mask
+    mask = pd.Series(True, index=df.index)
+    for f in spec.get('filters', []):
+        op = f.get('op', 'eq')
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter op: {op}")
+        series = df[f['column']]
+        mask &= FILTER_OPS[op](series, _coerce_filter_value(series, f.get('value')))
+    df = df[mask]
+    
+    group_by = list(spec.get('group_by', []))
+    
+    # Time buckets replace the date column with the start of its period
+    bucket = spec.get('time_bucket')
+    if bucket:
+        freq = TIME_BUCKETS.get(bucket.get('freq', 'day'))
+        if not freq:
+            raise ValueError(f"Unsupported time bucket: {bucket.get('freq')}")
+        column = bucket['column']
+        dates = pd.to_datetime(df[column], errors='coerce')
+        df = df.assign(**{column: dates.dt.to_period(freq).dt.start_time})
+        if column not in group_by:
+            group_by.insert(0, column)
+    
+    aggregates = spec.get('aggregates', [])
+    for a in aggregates:
+        if a.get('func') not in AGGREGATES:
+            raise ValueError(f"Unsupported aggregate: {a.get('func')}")
+    
+    if group_by:
+        grouped = df.groupby(group_by, sort=True, observed=True, dropna=False)
+        if aggregates:
+            result = grouped.agg(**{
+                a['as']: (a['column'], a['func']) for a in aggregates
+            }).reset_index()
+        else:
+            result = grouped.size().reset_index(name='count')
+    elif aggregates:
+        result = pd.DataFrame([{
+            a['as']: df[a['column']].agg(a['func']) for a in aggregates
+        }])
+    else:
+        result = df[spec['columns']] if spec.get('columns') else df
+    
+    # Sorting and top-N
+    sort = spec.get('sort', [])
+    if sort:
+        result = result.sort_values(
+            [s['column'] for s in sort],
+            ascending=[not s.get('desc', False) for s in sort]
+        )
+    if spec.get('limit'):
+        result = result.head(int(spec['limit']))
+    
+    # Bucketed dates are returned as ISO dates
+    if bucket:
+        result = result.assign(**{bucket['column']: result[bucket['column']].dt.strftime('%Y-%m-%d')})
+    
+    return result.reset_index(drop=True)
+
+def _rename_spec(spec, resolve):
+    """Rewrite column references in a spec to stored column names"""
+    spec = json.loads(json.dumps(spec))
+    for f in spec.get('filters', []):
+        f['column'] = resolve(f['column'])
+    spec['group_by'] = [resolve(c) for c in spec.get('group_by', [])]
+    spec['columns'] = [resolve(c) for c in spec.get('columns', [])]
+    for a in spec.get('aggregates', []):
+        # Default result names use the column name the client asked for
+        a['as'] = a.get('as') or f"{a['column']}_{a.get('func')}"
+        a['column'] = resolve(a['column'])
+    if spec.get('time_bucket'):
+        spec['time_bucket']['column'] = resolve(spec['time_bucket']['column'])
+    
+    # Sort keys may name result columns (aggregates, count) or source columns
+    aliases = {a['as'] for a in spec.get('aggregates', [])} | {'count'}
+    for s in spec.get('sort', []):
+        if s['column'] not in aliases:
+            s['column'] = resolve(s['column'])
+    return spec
+
+def execute_query(dataset, spec):
+    """Run a declarative query against a stored dataset, returning (result, error, cached)"""
+    try:
+        if not isinstance(spec, dict):
+            return None, "Query must be a JSON object", False
+        
+        key = (dataset.content_hash, json.dumps(spec, sort_keys=True))
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key], None, True
+        
+        # Uploads are stored with their first two columns renamed to label/value
+        stored_columns = ['label', 'value'] + dataset.columns[2:]
+        resolve = _column_resolver(dataset, stored_columns)
+        stored_spec = _rename_spec(spec, resolve)
+        
+        # Load only the columns the query needs
+        needed = _referenced_columns(stored_spec, stored_columns)
+        df = read_frame(dataset.content_hash, columns=needed or None)
+        
+        result = _run(df, stored_spec)
+        
+        # Present stored label/value columns under their original names
+        result = result.rename(columns=dict(zip(['label', 'value'], dataset.columns[:2])))
+        
+        with _cache_lock:
+            _cache[key] = result
+            _cache.move_to_end(key)
+            while len(_cache) > QUERY_CACHE_SIZE:
+                _cache.popitem(last=False)
+        
+        return result, None, False
+    except (KeyError, ValueError, TypeError, IndexError) as e:
+        return None, f"Invalid query: {str(e)}", False
@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Number of equal-width histogram bins for numeric columns
+HISTOGRAM_BINS = int(os.getenv('STATS_HISTOGRAM_BINS', '20'))
+
+# Quantiles reported for numeric columns
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# Columns with more values than this get quantiles from a random sample
+QUANTILE_SAMPLE_SIZE = 100000
+
+# HyperLogLog register index bits (2**12 registers, ~1.6% standard error)
+HLL_PRECISION = 12
+
+# Number of most frequent values reported for text columns
+TOP_VALUES = 10
+
+def _number(value):
+    """Convert a NumPy scalar to a JSON-safe float (None for NaN/inf)"""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+def approx_distinct(series):
+    """Estimate the number of distinct values with a HyperLogLog sketch"""
+    values = series.dropna()
+    if values.empty:
+        return 0
+    
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    registers_count = 1 << HLL_PRECISION
+    
+    # Top bits pick the register, the rest give the rank of the leftmost 1-bit
+    index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - HLL_PRECISION)) - 1)
+    bit_length = np.zeros(len(rest), dtype=np.int64)
+    nonzero = rest > 0
+    bit_length[nonzero] = np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.int64) + 1
+    rank = (64 - HLL_PRECISION) - bit_length + 1
+    
+    registers = np.zeros(registers_count, dtype=np.int64)
+    np.maximum.at(registers, index, rank)
+    
+    alpha = 0.7213 / (1 + 1.079 / registers_count)
+    estimate = alpha * registers_count ** 2 / np.sum(np.exp2(-registers.astype(np.float64)))
+    
+    # Small cardinalities are better estimated by linear counting
+    empty = np.count_nonzero(registers == 0)
+    if estimate <= 2.5 * registers_count and empty:
+        estimate = registers_count * np.log(registers_count / empty)
+    
+    return int(round(estimate))
+
+def _numeric_stats(series):
+    """Summary statistics, quantiles and histogram of a numeric column"""
+    values = series.dropna().to_numpy(dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {}
+    
+    # Large columns get approximate quantiles from a fixed-seed sample
+    sample = values
+    if len(values) > QUANTILE_SAMPLE_SIZE:
+        sample = np.random.default_rng(0).choice(values, QUANTILE_SAMPLE_SIZE, replace=False)
+    quantiles = np.quantile(sample, QUANTILES)
+    
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    
+    return {
+        'min': _number(values.min()),
+        'max': _number(values.max()),
+        'mean': _number(values.mean()),
+        'std': _number(values.std(ddof=1)) if len(values) > 1 else None,
+        'quantiles': {str(q): _number(v) for q, v in zip(QUANTILES, quantiles)},
+        'histogram': {
+            'edges': [_number(edge) for edge in edges],
+            'counts': counts.tolist()
+        }
+    }
+
+def _datetime_stats(series):
+    """Range of a datetime column"""
+    values = series.dropna()
+    if values.empty:
+        return {}
+    return {'min': values.min().isoformat(), 'max': values.max().isoformat()}
+
+def _text_stats(series):
+    """Most frequent values of a text or categorical column"""
+    counts = series.value_counts(dropna=True).head(TOP_VALUES)
+    return {'top_values': [{'value': str(value), 'count': int(count)} for value, count in counts.items()]}
+
+def compute_column_stats(df):
+    """Compute per-column statistics for a stored dataset"""
+    stats = {}
+    for column in df.columns:
+        series = df[column]
+        nulls = int(series.isna().sum())
+        
+        column_stats = {
+            'dtype': str(series.dtype),
+            'count': int(len(series) - nulls),
+            'nulls': nulls,
+            'distinct': approx_distinct(series)
+        }
+        
+        if pd.api.types.is_bool_dtype(series):
+            column_stats['true'] = int(series.sum())
+        elif pd.api.types.is_numeric_dtype(series):
+            column_stats.update(_numeric_stats(series))
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            column_stats.update(_datetime_stats(series))
+        else:
+            column_stats.update(_text_stats(series))
+        
+        stats[str(column)] = column_stats
+    
+    return stats
@@ -0,0 +1,112 @@
+import os
+import json
+import hashlib
+import tempfile
+import pandas as pd
+import pyarrow.parquet as pq
+from models import db, Dataset
+from datasets.background import DATASET_DIR
+
+# Raw uploads larger than this are spooled to disk while hashing
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+def spool_and_hash(stream, block_size=1024 * 1024):
+    """Hash an upload stream and return (seekable stream, sha256 hex digest, size)"""
+    digest = hashlib.sha256()
+    size = 0
+    
+    # Seekable streams (spooled multipart files) are hashed in place and rewound
+    if hasattr(stream, 'seekable') and stream.seekable():
+        position = stream.tell()
+        for block in iter(lambda: stream.read(block_size), b''):
+            digest.update(block)
+            size += len(block)
+        stream.seek(position)
+        return stream, digest.hexdigest(), size
+    
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    for block in iter(lambda: stream.read(block_size), b''):
+        digest.update(block)
+        spooled.write(block)
+        size += len(block)
+    spooled.seek(0)
+    
+    return spooled, digest.hexdigest(), size
+
+def dataset_path(content_hash):
+    """Path of the Parquet file for a content hash"""
+    return os.path.join(DATASET_DIR, content_hash[:2], f"{content_hash}.parquet")
+
+def has_frame(content_hash):
+    """Check whether a dataset has already been stored"""
+    return os.path.exists(dataset_path(content_hash))
+
+def write_frame(content_hash, df):
+    """Store a DataFrame as Parquet under its content hash"""
+    path = dataset_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    # Write to a temporary file first so readers never see a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(temp_path, index=False)
+    os.replace(temp_path, path)
+    
+    return path
+
+def read_frame(content_hash, columns=None):
+    """Load a stored dataset, optionally only some of its columns"""
+    return pd.read_parquet(dataset_path(content_hash), columns=columns)
+
+def read_table(content_hash, columns=None):
+    """Load a stored dataset as a pyarrow Table"""
+    return pq.read_table(dataset_path(content_hash), columns=columns)
+
+def stats_path(content_hash):
+    """Path of the column statistics stored next to a dataset"""
+    return os.path.join(DATASET_DIR, content_hash[:2], f"{content_hash}.stats.json")
+
+def write_stats(content_hash, stats):
+    """Store column statistics for a dataset"""
+    path = stats_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(stats, f)
+    os.replace(temp_path, path)
+
+def read_stats(content_hash):
+    """Load stored column statistics, or None if they were never computed"""
+    try:
+        with open(stats_path(content_hash)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def find_dataset(user_id, content_hash):
+    """Get a user's dataset by content hash"""
+    return Dataset.query.filter_by(user_id=user_id, content_hash=content_hash).first()
+
+def find_dataset_by_hash(content_hash):
+    """Get any user's dataset record for a content hash"""
+    return Dataset.query.filter_by(content_hash=content_hash).first()
+
+def register_dataset(user_id, content_hash, filename, size_bytes, row_count, columns, report=None):
+    """Record dataset metadata for a user"""
+    dataset = find_dataset(user_id, content_hash)
+    if dataset:
+        return dataset
+    
+    dataset = Dataset(
+        user_id=user_id,
+        content_hash=content_hash,
+        filename=filename,
+        size_bytes=size_bytes,
+        row_count=row_count,
+        columns_json=json.dumps([str(column) for column in columns]),
+        report_json=json.dumps(report or {})
+    )
+    db.session.add(dataset)
+    db.session.commit()
+    
+    return dataset
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from datetime import date, timedelta
+
+# SQLite database holding finalized report days
+GA_REPORT_CACHE_DB = os.getenv(
+    'GA_REPORT_CACHE_DB',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'ga_reports.db')
+)
+
+# Days up to and including today that GA may still revise; the default leaves a
+# day of slack for properties in a timezone behind the server's
+GA_CACHE_MUTABLE_DAYS = int(os.getenv('GA_CACHE_MUTABLE_DAYS', '3'))
+
+# Per-thread database connections
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'fully_cached': 0, 'day_hits': 0, 'day_misses': 0, 'fetches': 0}
+
+def _connect():
+    """Get this thread's connection to the report cache"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    
+    os.makedirs(os.path.dirname(GA_REPORT_CACHE_DB), exist_ok=True)
+    conn = sqlite3.connect(GA_REPORT_CACHE_DB, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS report_days ('
+        'cache_key TEXT NOT NULL, '
+        'day TEXT NOT NULL, '
+        'user_id TEXT NOT NULL, '
+        'rows TEXT NOT NULL, '
+        'fetched_at REAL NOT NULL, '
+        'PRIMARY KEY (cache_key, day))'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS report_days_user ON report_days (user_id)')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS report_types ('
+        'cache_key TEXT PRIMARY KEY, '
+        'metric_types TEXT NOT NULL)'
+    )
+    
+    _local.conn = conn
+    _local.pid = os.getpid()
+    
+    return conn
+
+def is_cacheable(start_date, end_date, dimensions):
+    """Check whether a report can be split into day partitions"""
+    if 'date' not in dimensions:
+        return False
+    
+    # Relative dates such as "7daysAgo" are left to the API
+    try:
+        return date.fromisoformat(start_date) <= date.fromisoformat(end_date)
+    except (TypeError, ValueError):
+        return False
+
+def cache_key(user_id, property_id, metrics, dimensions):
+    """Key a report by user, property, metrics and dimensions"""
+    # The user is part of the key so cached rows are only served to someone with access
+    identity = [str(user_id), str(property_id), list(metrics), list(dimensions)]
+    return hashlib.sha256(json.dumps(identity).encode()).hexdigest()
+
+def days_between(start_date, end_date):
+    """List ISO days from start_date to end_date inclusive"""
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+def is_final(day):
+    """Check whether GA will no longer revise a day's numbers"""
+    return date.fromisoformat(day) <= date.today() - timedelta(days=GA_CACHE_MUTABLE_DAYS)
+
+def contiguous_ranges(days):
+    """Group sorted ISO days into (start, end) runs of consecutive days"""
+    ranges = []
+    for day in days:
+        if ranges and date.fromisoformat(day) - date.fromisoformat(ranges[-1][1]) == timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    
+    return [tuple(r) for r in ranges]
+
+def partition_by_day(columns, days):
+    """Split report columns into ISO days by their YYYYMMDD date column"""
+    indices = {day: [] for day in days}
+    for i, value in enumerate(columns.get('date', ())):
+        day = f"{value[:4]}-{value[4:6]}-{value[6:8]}"
+        if day in indices:
+            indices[day].append(i)
+    
+    return {
+        day: {name: [values[i] for i in positions] for name, values in columns.items()}
+        for day, positions in indices.items()
+    }
+
+def _day_columns(partition):
+    """Read a cached day as columns, converting days cached as row dicts"""
+    if isinstance(partition, dict):
+        return partition
+    return {name: [row[name] for row in partition] for name in (partition[0] if partition else ())}
+
+def get_days(key, days):
+    """Get the cached columns of the finalized days among `days`"""
+    days = [day for day in days if is_final(day)]
+    cached = {}
+    
+    # Query in chunks to stay under SQLite's parameter limit
+    conn = _connect()
+    for i in range(0, len(days), 500):
+        chunk = days[i:i + 500]
+        cursor = conn.execute(
+            f"SELECT day, rows FROM report_days WHERE cache_key = ? AND day IN ({', '.join('?' * len(chunk))})",
+            [key] + chunk
+        )
+        for day, rows in cursor:
+            cached[day] = _day_columns(json.loads(rows))
+    
+    return cached
+
+def put_days(user_id, key, partitions):
+    """Cache the columns of finalized days; days still open to revision are skipped"""
+    now = time.time()
+    records = [
+        (key, day, str(user_id), json.dumps(columns), now)
+        for day, columns in partitions.items()
+        if is_final(day)
+    ]
+    if records:
+        _connect().executemany(
+            'INSERT OR REPLACE INTO report_days (cache_key, day, user_id, rows, fetched_at) VALUES (?, ?, ?, ?, ?)',
+            records
+        )
+    
+    return len(records)
+
+def get_metric_types(key):
+    """Get the metric dtypes recorded for a cached report, or None"""
+    row = _connect().execute('SELECT metric_types FROM report_types WHERE cache_key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def put_metric_types(key, metric_types):
+    """Record the metric dtypes of a cached report"""
+    _connect().execute(
+        'INSERT OR REPLACE INTO report_types (cache_key, metric_types) VALUES (?, ?)',
+        (key, json.dumps(metric_types))
+    )
+
+def delete_user_reports(user_id):
+    """Drop every cached report day of a user"""
+    conn = _connect()
+    keys = [row[0] for row in conn.execute('SELECT DISTINCT cache_key FROM report_days WHERE user_id = ?', (str(user_id),))]
+    conn.executemany('DELETE FROM report_types WHERE cache_key = ?', [(key,) for key in keys])
+    cursor = conn.execute('DELETE FROM report_days WHERE user_id = ?', (str(user_id),))
+    return cursor.rowcount
+
+def record_lookup(day_hits, day_misses, fetches):
+    """Count one cached report lookup"""
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['day_hits'] += day_hits
+        _stats['day_misses'] += day_misses
+        _stats['fetches'] += fetches
+        if not fetches:
+            _stats['fully_cached'] += 1
+
+def get_report_cache_stats():
+    """Get hit/miss counters of the report cache"""
+    with _stats_lock:
+        lookups = _stats['day_hits'] + _stats['day_misses']
+        return dict(
+            _stats,
+            day_hit_rate=_stats['day_hits'] / lookups if lookups else None,
+            mutable_days=GA_CACHE_MUTABLE_DAYS
+        )
@@ -1,15 +1,37 @@
 import os
 import json
+import numpy as np
+import pandas as pd
 from datetime import datetime, timedelta
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from google.analytics.data_v1beta.types import (
-    DateRange, Dimension, Metric, RunReportRequest
+    BatchRunReportsRequest, DateRange, Dimension, Metric, MetricType, RunReportRequest
 )
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from config.credentials import save_credentials, get_credentials, delete_credentials
+from integrations.google_clients import get_clients, release_clients
+from integrations import ga_report_cache as report_cache
+from integrations.sharding import split_date_range, fetch_sharded
+from integrations.utils import get_token_expiry_timestamp
+
+# batchRunReports accepts at most 5 reports per call
+GA_BATCH_SIZE = 5
+GA_BATCH_CONCURRENCY = int(os.getenv('GA_BATCH_CONCURRENCY', '4'))
+GA_BATCH_MAX_REPORTS = int(os.getenv('GA_BATCH_MAX_REPORTS', '50'))
+
+# Rows requested per page when walking large reports (the API allows up to 250000)
+GA_PAGE_SIZE = int(os.getenv('GA_PAGE_SIZE', '10000'))
+
+# Integer metrics decode to int64; every other metric type is fractional
+METRIC_DTYPES = {MetricType.TYPE_INTEGER: 'int64'}
+
+# GA's format for the date dimension, kept for date labels in every response form
+GA_DATE_FORMAT = '%Y%m%d'
+
+# Sharded reports are merged by day, so they need concrete dates and the date dimension
+SHARD_REPORT_ERROR = "Sharded reports need ISO start and end dates and the date dimension"
 
 # Google Analytics API configuration
 SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
@@ -82,7 +104,10 @@ def handle_callback(user_id, auth_code, state):
             "scopes": credentials.scopes,
             "expiry": credentials.expiry.isoformat() if credentials.expiry else None
         }
-        save_credentials(user_id, "google_analytics", creds_data)
+        save_credentials(
+            user_id, "google_analytics", creds_data,
+            expires_at=get_token_expiry_timestamp("google_analytics", creds_data)
+        )
         
         return True, "Successfully authenticated with Google Analytics"
     except Exception as e:
@@ -92,23 +117,14 @@ def handle_callback(user_id, auth_code, state):
 def get_analytics_properties(user_id):
     """Get list of Google Analytics properties"""
     try:
-        # Get credentials
-        creds_data = get_credentials(user_id, "google_analytics")
-        if not creds_data:
-            return None, "No credentials found"
-        
-        # Convert expiry string to datetime
-        if creds_data["expiry"]:
-            creds_data["expiry"] = datetime.fromisoformat(creds_data["expiry"])
-        
-        # Create credentials object
-        credentials = Credentials.from_authorized_user_info(creds_data)
-        
-        # Build service
-        service = build('analyticsadmin', 'v1alpha', credentials=credentials)
+        # Get the user's pooled clients
+        clients, error = get_clients(user_id)
+        if error:
+            return None, error
         
         # Get properties
-        response = service.properties().list().execute()
+        with clients.admin_lock:
+            response = clients.admin_service.properties().list().execute()
         properties = response.get('properties', [])
         
         return properties, None
@@ -118,68 +134,349 @@ def get_analytics_properties(user_id):
     except Exception as e:
         return None, f"Error: {str(e)}"
 
-def get_analytics_data(user_id, property_id, start_date=None, end_date=None, metrics=None, dimensions=None):
-    """Get Google Analytics data for a property"""
+def _resolve_report_args(start_date=None, end_date=None, metrics=None, dimensions=None):
+    """Fill in the default date range, metrics and dimensions"""
+    # Default dates if not provided
+    if not start_date:
+        start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    if not end_date:
+        end_date = datetime.now().strftime('%Y-%m-%d')
+    
+    # Default metrics and dimensions if not provided
+    if not metrics:
+        metrics = ['activeUsers', 'screenPageViews', 'sessions', 'engagementRate']
+    if not dimensions:
+        dimensions = ['date']
+    
+    return start_date, end_date, metrics, dimensions
+
+def _build_report_request(start_date=None, end_date=None, metrics=None, dimensions=None, property_id=None):
+    """Build a report request, filling in the default date range, metrics and dimensions"""
+    start_date, end_date, metrics, dimensions = _resolve_report_args(start_date, end_date, metrics, dimensions)
+    
+    # Batched requests inherit the property from the batch
+    return RunReportRequest(
+        property=f"properties/{property_id}" if property_id else None,
+        date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
+        metrics=[Metric(name=m) for m in metrics],
+        dimensions=[Dimension(name=d) for d in dimensions]
+    )
+
+def _metric_types(response):
+    """Map each metric to the NumPy dtype of its values"""
+    return {
+        metric.name: METRIC_DTYPES.get(metric.type_, 'float64')
+        for metric in response.metric_headers
+    }
+
+def _decode_report(response):
+    """Convert a report response into dimensions, metrics and row dicts"""
+    result = {
+        "dimensions": [dim.name for dim in response.dimension_headers],
+        "metrics": [metric.name for metric in response.metric_headers],
+        "metric_types": _metric_types(response),
+        "row_count": response.row_count,
+        "rows": []
+    }
+    
+    for row in response.rows:
+        row_data = {}
+        
+        # Add dimensions
+        for i, dimension in enumerate(row.dimension_values):
+            row_data[result["dimensions"][i]] = dimension.value
+        
+        # Add metrics
+        for i, metric in enumerate(row.metric_values):
+            row_data[result["metrics"][i]] = metric.value
+        
+        result["rows"].append(row_data)
+    
+    return result
+
+def _typed_column(name, values, dtype=None):
+    """Build a typed array from a column of GA string values"""
+    if dtype:
+        # NumPy parses the whole column of numeric strings at once
+        return np.array(values, dtype=np.str_).astype(dtype) if values else np.empty(0, dtype=dtype)
+    
+    if name == 'date':
+        # Rows GA folds into "(other)" have no date, so such columns stay strings
+        dates = pd.to_datetime(pd.Series(values, dtype=object), format=GA_DATE_FORMAT, errors='coerce')
+        if not dates.isna().any():
+            return dates.to_numpy()
+    
+    return np.array(values, dtype=object)
+
+def _typed_columns(data):
+    """Type every string column of a report decoded by _decode_report_strings"""
+    metric_types = data["metric_types"]
+    return {
+        name: _typed_column(name, values, metric_types.get(name, 'float64') if name in data["metrics"] else None)
+        for name, values in data["columns"].items()
+    }
+
+def _decode_report_strings(response):
+    """Convert a report response into columns of GA's string values"""
+    dimensions = [dim.name for dim in response.dimension_headers]
+    metrics = [metric.name for metric in response.metric_headers]
+    
+    # Transpose the protobuf rows in one pass
+    dimension_values = [[] for _ in dimensions]
+    metric_values = [[] for _ in metrics]
+    for row in response.rows:
+        for values, dimension in zip(dimension_values, row.dimension_values):
+            values.append(dimension.value)
+        for values, metric in zip(metric_values, row.metric_values):
+            values.append(metric.value)
+    
+    columns = dict(zip(dimensions, dimension_values))
+    columns.update(zip(metrics, metric_values))
+    
+    return {
+        "dimensions": dimensions,
+        "metrics": metrics,
+        "metric_types": _metric_types(response),
+        "row_count": response.row_count,
+        "columns": columns
+    }
+
+def _decode_report_columns(response):
+    """Convert a report response into typed column arrays instead of row dicts"""
+    data = _decode_report_strings(response)
+    
+    # Type each column as a whole
+    data["columns"] = _typed_columns(data)
+    return data
+
+def _join_columns(parts):
+    """Join the pages of one column, typed arrays or string lists"""
+    if isinstance(parts[0], np.ndarray):
+        return np.concatenate(parts)
+    return list(chain.from_iterable(parts))
+
+def get_analytics_pages(user_id, property_id, start_date=None, end_date=None, metrics=None, dimensions=None, page_size=None, columnar=False):
+    """Get a generator of report pages that walks offset until every row is read
+    
+    The first page is fetched before returning so credential and API errors are
+    reported up front; each yielded page has the same shape as get_analytics_data.
+    """
+    decode = _decode_report_columns if columnar else _decode_report
+    return _report_pages(user_id, property_id, start_date, end_date, metrics, dimensions, page_size, decode)
+
+def _report_pages(user_id, property_id, start_date, end_date, metrics, dimensions, page_size, decode):
+    """Fetch the first report page and return a generator of every page run through decode"""
     try:
-        # Default dates if not provided
-        if not start_date:
-            start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-        
-        # Default metrics and dimensions if not provided
-        if not metrics:
-            metrics = ['activeUsers', 'screenPageViews', 'sessions', 'engagementRate']
-        if not dimensions:
-            dimensions = ['date']
-        
-        # Get credentials
-        creds_data = get_credentials(user_id, "google_analytics")
-        if not creds_data:
-            return None, "No credentials found"
-        
-        # Convert expiry string to datetime
-        if creds_data["expiry"]:
-            creds_data["expiry"] = datetime.fromisoformat(creds_data["expiry"])
-        
-        # Create credentials object
-        credentials = Credentials.from_authorized_user_info(creds_data)
-        
-        # Create a client
-        client = BetaAnalyticsDataClient(credentials=credentials)
-        
-        # Build the request
-        request = RunReportRequest(
-            property=f"properties/{property_id}",
-            date_ranges=[DateRange(start_date=start_date, end_date=end_date)],
-            metrics=[Metric(name=m) for m in metrics],
-            dimensions=[Dimension(name=d) for d in dimensions]
-        )
+        # Get the user's pooled clients
+        clients, error = get_clients(user_id)
+        if error:
+            return None, error
+        client = clients.data_client
+        
+        # Build the request for the first page
+        request = _build_report_request(start_date, end_date, metrics, dimensions, property_id=property_id)
+        request.limit = page_size or GA_PAGE_SIZE
         
-        # Make the request
         response = client.run_report(request)
+    except HttpError as e:
+        error_details = json.loads(e.content.decode())
+        return None, f"API Error: {error_details.get('error', {}).get('message', str(e))}"
+    except Exception as e:
+        return None, f"Error: {str(e)}"
+
+    def pages():
+        page, offset = response, 0
+        while True:
+            yield decode(page)
+            
+            # row_count is the total across all pages
+            offset += len(page.rows)
+            if not page.rows or offset >= page.row_count:
+                break
+            
+            request.offset = offset
+            page = client.run_report(request)
+    
+    return pages(), None
+
+def _fetch_analytics_data(user_id, property_id, start_date, end_date, metrics, dimensions, decode=_decode_report):
+    """Fetch a whole report from the API, page by page"""
+    pages, error = _report_pages(user_id, property_id, start_date, end_date, metrics, dimensions, None, decode)
+    if error:
+        return None, error
+    
+    # Page through the whole report instead of stopping at the API's row cap
+    result = None
+    page_columns = []
+    for page in pages:
+        if result is None:
+            result = page
+        elif "rows" in page:
+            result["rows"].extend(page["rows"])
+        if "columns" in page:
+            page_columns.append(page["columns"])
+    
+    # Join each column's pages with a single copy
+    if len(page_columns) > 1:
+        result["columns"] = {
+            name: _join_columns([columns[name] for columns in page_columns])
+            for name in result["columns"]
+        }
+    
+    return result, None
+
+def _get_cached_analytics_data(user_id, property_id, start_date, end_date, metrics, dimensions, columnar=False, shard=None):
+    """Serve finalized days from the report cache and fetch only the rest, optionally in date slices"""
+    key = report_cache.cache_key(user_id, property_id, metrics, dimensions)
+    days = report_cache.days_between(start_date, end_date)
+    partitions = report_cache.get_days(key, days)
+    metric_types = report_cache.get_metric_types(key) or {}
+    
+    # Missing and still-mutable days are fetched in as few contiguous ranges as possible
+    missing = [day for day in days if day not in partitions]
+    ranges = report_cache.contiguous_ranges(missing)
+    
+    # Days are cached and merged as columns of GA's strings, so nothing is decoded into row dicts
+    def fetch_range(range_start, range_end):
+        return _fetch_analytics_data(
+            user_id, property_id, range_start, range_end, metrics, dimensions, decode=_decode_report_strings
+        )
+    
+    # Long ranges are split into slices fetched concurrently; results come back in range order
+    if shard:
+        ranges = [date_slice for r in ranges for date_slice in split_date_range(*r, shard)]
+        fetched_ranges, error = fetch_sharded(fetch_range, ranges)
+        if error:
+            return None, error
+    else:
+        fetched_ranges = []
+        for range_start, range_end in ranges:
+            data, error = fetch_range(range_start, range_end)
+            if error:
+                return None, error
+            fetched_ranges.append(data)
+    
+    for (range_start, range_end), data in zip(ranges, fetched_ranges):
+        fetched = report_cache.partition_by_day(data["columns"], report_cache.days_between(range_start, range_end))
+        report_cache.put_days(user_id, key, fetched)
+        partitions.update(fetched)
         
-        # Process the response
-        result = {
-            "dimensions": [dim.name for dim in response.dimension_headers],
-            "metrics": [metric.name for metric in response.metric_headers],
-            "rows": []
+        if data["metric_types"] != metric_types:
+            metric_types = data["metric_types"]
+            report_cache.put_metric_types(key, metric_types)
+    
+    report_cache.record_lookup(len(days) - len(missing), len(missing), len(ranges))
+    
+    # Merge cached and fresh partitions in date order, one column at a time
+    names = list(dimensions) + list(metrics)
+    data = {
+        "dimensions": list(dimensions),
+        "metrics": list(metrics),
+        "metric_types": {metric: metric_types.get(metric, 'float64') for metric in metrics},
+        "columns": {
+            name: list(chain.from_iterable(partitions[day].get(name, ()) for day in days))
+            for name in names
         }
+    }
+    data["row_count"] = len(data["columns"]["date"])
+    
+    if columnar:
+        data["columns"] = _typed_columns(data)
+        return data, None
+    
+    columns = data.pop("columns")
+    data["rows"] = [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+    return data, None
+
+def get_analytics_data(user_id, property_id, start_date=None, end_date=None, metrics=None, dimensions=None, columnar=False, shard=None):
+    """Get Google Analytics data for a property
+    
+    With columnar=True the rows are replaced by "columns": one typed NumPy array
+    per dimension and metric (int64/float64 from the metric type, datetime64 for date,
+    or strings if GA returned dates such as "(other)").
+    With shard='day', 'week' or 'month' the days missing from the cache are fetched
+    as concurrent slices of that size, each retried on its own.
+    """
+    try:
+        start_date, end_date, metrics, dimensions = _resolve_report_args(start_date, end_date, metrics, dimensions)
         
-        for row in response.rows:
-            row_data = {}
-            
-            # Add dimensions
-            for i, dimension in enumerate(row.dimension_values):
-                row_data[result["dimensions"][i]] = dimension.value
+        if shard and not report_cache.is_cacheable(start_date, end_date, dimensions):
+            return None, SHARD_REPORT_ERROR
+        
+        # Reports split by date only need the days that can still change
+        if report_cache.is_cacheable(start_date, end_date, dimensions):
+            return _get_cached_analytics_data(
+                user_id, property_id, start_date, end_date, metrics, dimensions, columnar=columnar, shard=shard
+            )
+        
+        decode = _decode_report_columns if columnar else _decode_report
+        return _fetch_analytics_data(user_id, property_id, start_date, end_date, metrics, dimensions, decode=decode)
+    except HttpError as e:
+        error_details = json.loads(e.content.decode())
+        return None, f"API Error: {error_details.get('error', {}).get('message', str(e))}"
+    except Exception as e:
+        return None, f"Error: {str(e)}"
+
+def get_analytics_reports(user_id, property_id, specs):
+    """Get several reports for one property through batchRunReports
+    
+    Each spec is a dict with optional start_date, end_date, metrics and dimensions.
+    Specs are sent GA_BATCH_SIZE per RPC, with up to GA_BATCH_CONCURRENCY RPCs in
+    flight; results are returned in the order of `specs`. Reports longer than
+    GA_PAGE_SIZE rows are paged by offset in further batches until complete.
+    """
+    try:
+        # Get the user's pooled clients
+        clients, error = get_clients(user_id)
+        if error:
+            return None, error
+        client = clients.data_client
+        
+        requests = [
+            _build_report_request(
+                spec.get("start_date"), spec.get("end_date"),
+                spec.get("metrics"), spec.get("dimensions")
+            )
+            for spec in specs
+        ]
+        for request in requests:
+            request.limit = GA_PAGE_SIZE
+
+        def run_batch(batch):
+            return client.batch_run_reports(BatchRunReportsRequest(
+                property=f"properties/{property_id}",
+                requests=[requests[i] for i in batch]
+            ))
+        
+        # Each round fetches the next page of every unfinished report, so the first round gets them all
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+        while pending:
+            # Split the unfinished reports into batches the API accepts
+            batches = [pending[i:i + GA_BATCH_SIZE] for i in range(0, len(pending), GA_BATCH_SIZE)]
             
-            # Add metrics
-            for i, metric in enumerate(row.metric_values):
-                row_data[result["metrics"][i]] = metric.value
+            # The gRPC client is thread-safe, so batches share its channel
+            if len(batches) == 1:
+                responses = [run_batch(batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(GA_BATCH_CONCURRENCY, len(batches))) as executor:
+                    responses = list(executor.map(run_batch, batches))
             
-            result["rows"].append(row_data)
+            pending = []
+            for batch, response in zip(batches, responses):
+                for i, report in zip(batch, response.reports):
+                    page = _decode_report(report)
+                    if results[i] is None:
+                        results[i] = page
+                    else:
+                        results[i]["rows"].extend(page["rows"])
+                    
+                    # row_count is the total across all pages
+                    requests[i].offset += len(report.rows)
+                    if report.rows and requests[i].offset < report.row_count:
+                        pending.append(i)
         
-        return result, None
+        return results, None
     except HttpError as e:
         error_details = json.loads(e.content.decode())
         return None, f"API Error: {error_details.get('error', {}).get('message', str(e))}"
@@ -189,8 +486,10 @@ def get_analytics_data(user_id, property_id, start_date=None, end_date=None, met
 def disconnect(user_id):
     """Disconnect Google Analytics for a user"""
     try:
-        # Remove credentials
+        # Remove credentials, close pooled clients and drop cached reports
         delete_credentials(user_id, "google_analytics")
+        release_clients(user_id)
+        report_cache.delete_user_reports(user_id)
         return True, None
     except Exception as e:
         return False, f"Error: {str(e)}" 
\ No newline at end of file
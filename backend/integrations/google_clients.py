@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import httplib2
+import google_auth_httplib2
+from google.analytics.data_v1beta import BetaAnalyticsDataClient
+from google.oauth2.credentials import Credentials
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document, DISCOVERY_URI
+from config.credentials import get_credentials, mark_credentials_used
+
+# Pool sizing: clients idle for longer than the timeout are closed
+GA_CLIENT_POOL_SIZE = int(os.getenv('GA_CLIENT_POOL_SIZE', '256'))
+GA_CLIENT_IDLE_TIMEOUT = float(os.getenv('GA_CLIENT_IDLE_TIMEOUT', '900'))
+
+# Admin API used to list properties
+ADMIN_API = ('analyticsadmin', 'v1alpha')
+
+# user_id -> _ClientEntry, least recently used first
+_pool = OrderedDict()
+_pool_lock = threading.Lock()
+_pool_stats = {'hits': 0, 'misses': 0, 'rebuilds': 0, 'evictions': 0}
+_last_sweep = 0.0
+
+# Parsed discovery documents, shared by every user
+_discovery_docs = {}
+_discovery_lock = threading.Lock()
+
+class _ClientEntry:
+    """Credentials and API clients of one user, built on first use"""
+
+    def __init__(self, fingerprint, credentials):
+        self.fingerprint = fingerprint
+        self.credentials = credentials
+        self.last_used = time.monotonic()
+        self._data_client = None
+        self._admin_service = None
+        self._build_lock = threading.Lock()
+        # httplib2 is not thread-safe, so admin calls are serialized per user
+        self.admin_lock = threading.Lock()
+
+    @property
+    def data_client(self):
+        """Data API client; its gRPC channel is reused across reports"""
+        with self._build_lock:
+            if self._data_client is None:
+                self._data_client = BetaAnalyticsDataClient(credentials=self.credentials)
+            return self._data_client
+
+    @property
+    def admin_service(self):
+        """Admin API service built from the cached discovery document"""
+        with self._build_lock:
+            if self._admin_service is None:
+                http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+                self._admin_service = build_from_document(get_discovery_document(*ADMIN_API), http=http)
+            return self._admin_service
+
+    def close(self):
+        """Close the gRPC channel and HTTP connections"""
+        try:
+            if self._data_client is not None:
+                self._data_client.transport.close()
+            if self._admin_service is not None:
+                self._admin_service.close()
+        except Exception as e:
+            print(f"Error closing Google Analytics clients: {e}")
+
+def get_discovery_document(service_name, version):
+    """Load a discovery document once per process"""
+    key = (service_name, version)
+    with _discovery_lock:
+        if key not in _discovery_docs:
+            # Prefer the copy bundled with the client library over a network fetch
+            document = discovery_cache.get_static_doc(service_name, version)
+            if document is None:
+                uri = DISCOVERY_URI.format(api=service_name, apiVersion=version)
+                _, content = httplib2.Http().request(uri)
+                document = content.decode()
+            _discovery_docs[key] = json.loads(document)
+        return _discovery_docs[key]
+
+def credentials_fingerprint(creds_data):
+    """Hash the parts of stored credentials that identify a client, ignoring the access token"""
+    identity = [creds_data.get(field) for field in ('refresh_token', 'client_id', 'client_secret', 'token_uri')]
+    identity.append(sorted(creds_data.get('scopes') or []))
+    return hashlib.sha256(json.dumps(identity).encode()).hexdigest()
+
+def build_credentials(creds_data):
+    """Create a google-auth credentials object from stored credentials"""
+    expiry = creds_data.get('expiry')
+    return Credentials(
+        token=creds_data.get('token'),
+        refresh_token=creds_data.get('refresh_token'),
+        token_uri=creds_data.get('token_uri'),
+        client_id=creds_data.get('client_id'),
+        client_secret=creds_data.get('client_secret'),
+        scopes=creds_data.get('scopes'),
+        expiry=datetime.fromisoformat(expiry) if expiry else None
+    )
+
+def _sweep_idle(now):
+    """Close clients idle for longer than GA_CLIENT_IDLE_TIMEOUT; call with the pool lock held"""
+    global _last_sweep
+    
+    # Scanning is cheap but pointless more often than a fraction of the timeout
+    if now - _last_sweep < min(60.0, GA_CLIENT_IDLE_TIMEOUT / 4):
+        return []
+    _last_sweep = now
+    
+    idle = [user_id for user_id, entry in _pool.items() if now - entry.last_used > GA_CLIENT_IDLE_TIMEOUT]
+    return [_pool.pop(user_id) for user_id in idle]
+
+def _adopt_stored_token(entry, creds_data):
+    """Copy a newer stored access token onto pooled credentials; call with the pool lock held"""
+    token = creds_data.get('token')
+    if not token or token == entry.credentials.token:
+        return
+    
+    # Keep a token google-auth refreshed inline here if it outlives the stored one
+    expiry = creds_data.get('expiry')
+    expiry = datetime.fromisoformat(expiry) if expiry else None
+    if entry.credentials.expiry and (expiry is None or expiry <= entry.credentials.expiry):
+        return
+    
+    entry.credentials.token = token
+    entry.credentials.expiry = expiry
+
+def get_clients(user_id):
+    """Get the pooled clients for a user, rebuilding them only when the credentials changed"""
+    creds_data = get_credentials(user_id, "google_analytics")
+    if not creds_data:
+        release_clients(user_id)
+        return None, "No credentials found"
+    
+    # Tokens of users who stop calling the API are left to lapse by the refresher
+    mark_credentials_used(user_id, "google_analytics")
+    
+    user_id = str(user_id)
+    fingerprint = credentials_fingerprint(creds_data)
+    now = time.monotonic()
+    
+    with _pool_lock:
+        closing = _sweep_idle(now)
+        
+        while len(_pool) >= GA_CLIENT_POOL_SIZE and user_id not in _pool:
+            closing.append(_pool.popitem(last=False)[1])
+        _pool_stats['evictions'] += len(closing)
+        
+        entry = _pool.get(user_id)
+        if entry and entry.fingerprint == fingerprint:
+            _pool_stats['hits'] += 1
+            
+            # The refresher may have renewed the token in another worker
+            _adopt_stored_token(entry, creds_data)
+        else:
+            if entry:
+                _pool_stats['rebuilds'] += 1
+                closing.append(entry)
+            else:
+                _pool_stats['misses'] += 1
+            entry = _ClientEntry(fingerprint, build_credentials(creds_data))
+            _pool[user_id] = entry
+        
+        entry.last_used = now
+        _pool.move_to_end(user_id)
+    
+    # Close outside the lock; channel shutdown can block
+    for stale in closing:
+        stale.close()
+    
+    return entry, None
+
+def update_pooled_token(user_id, token, expiry):
+    """Hand a refreshed access token to a user's pooled clients"""
+    with _pool_lock:
+        entry = _pool.get(str(user_id))
+    
+    # The clients share this credentials object, so they use the token on their next call
+    if entry:
+        entry.credentials.token = token
+        entry.credentials.expiry = expiry
+    
+    return entry is not None
+
+def release_clients(user_id):
+    """Close and forget a user's pooled clients"""
+    with _pool_lock:
+        entry = _pool.pop(str(user_id), None)
+    
+    if entry:
+        entry.close()
+
+def get_client_pool_stats():
+    """Get hit/miss counters and size of the client pool"""
+    with _pool_lock:
+        return dict(
+            _pool_stats,
+            size=len(_pool),
+            max_size=GA_CLIENT_POOL_SIZE,
+            idle_timeout_seconds=GA_CLIENT_IDLE_TIMEOUT
+        )
@@ -1,11 +1,20 @@
 import os
 import json
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from facebook_business.api import FacebookAdsApi
+from facebook_business.session import FacebookSession
 from facebook_business.adobjects.adaccount import AdAccount
 from facebook_business.adobjects.adsinsights import AdsInsights
 from facebook_business.exceptions import FacebookRequestError
-from config.credentials import save_credentials, get_credentials, delete_credentials
+from config.credentials import save_credentials, get_credentials, delete_credentials, mark_credentials_used
+from integrations.meta_session import mount_pool, http_session, META_HTTP_TIMEOUT
+from integrations.meta_throttle import AdaptiveLimiter
+from integrations.sharding import split_date_range, fetch_sharded
+from integrations.utils import get_token_expiry_timestamp
 
 # Meta API configuration
 APP_ID = os.getenv("META_APP_ID", "")
@@ -13,6 +22,62 @@ APP_SECRET = os.getenv("META_APP_SECRET", "")
 REDIRECT_URI = "http://localhost:5000/api/integrations/meta/callback"
 SCOPES = ['ads_read', 'ads_management', 'business_management']
 
+# Rows requested per Graph API page when walking insights page by page
+META_PAGE_LIMIT = int(os.getenv('META_PAGE_LIMIT', '500'))
+INSIGHT_LEVELS = ('account', 'campaign', 'adset', 'ad')
+
+# Multi-account fetches: accounts per request and Graph API calls in flight at most
+META_FANOUT_MAX_ACCOUNTS = int(os.getenv('META_FANOUT_MAX_ACCOUNTS', '50'))
+META_FANOUT_CONCURRENCY = int(os.getenv('META_FANOUT_CONCURRENCY', '8'))
+
+# An AdReportRun covers one time range, so async jobs cannot be split into slices
+SHARD_ASYNC_ERROR = "Async insights jobs cannot be sharded; request the slices as separate jobs"
+
+# Users whose API instances are kept; instances are cheap, their connections live in the shared pool
+META_API_CACHE_SIZE = int(os.getenv('META_API_CACHE_SIZE', '256'))
+
+# user_id -> (access_token, FacebookAdsApi), least recently used first
+_apis = OrderedDict()
+_apis_lock = threading.Lock()
+
+def get_api(user_id):
+    """Get a user's FacebookAdsApi instance, rebuilt only when their access token changed
+    
+    Instances are passed explicitly to AdAccount and User instead of replacing the
+    process-wide default with FacebookAdsApi.init, so threads serving different
+    users never share a token. Every instance sends its requests through the
+    shared connection pool in integrations.meta_session.
+    """
+    creds_data = get_credentials(user_id, "meta_ads")
+    if not creds_data:
+        release_api(user_id)
+        return None, "No credentials found"
+    
+    # Tokens of users who stop calling the API are left to lapse by the refresher
+    mark_credentials_used(user_id, "meta_ads")
+    
+    user_id = str(user_id)
+    access_token = creds_data["access_token"]
+    
+    with _apis_lock:
+        entry = _apis.get(user_id)
+        if not entry or entry[0] != access_token:
+            session = FacebookSession(APP_ID, APP_SECRET, access_token, timeout=META_HTTP_TIMEOUT)
+            mount_pool(session.requests)
+            entry = (access_token, FacebookAdsApi(session))
+            _apis[user_id] = entry
+        _apis.move_to_end(user_id)
+        
+        while len(_apis) > META_API_CACHE_SIZE:
+            _apis.popitem(last=False)
+    
+    return entry[1], None
+
+def release_api(user_id):
+    """Forget a user's API instance"""
+    with _apis_lock:
+        _apis.pop(str(user_id), None)
+
 def get_auth_url(user_id):
     """Generate Meta OAuth2 authorization URL"""
     try:
@@ -50,7 +115,6 @@ def handle_callback(user_id, auth_code, state):
             return False, "Invalid state parameter"
         
         # Exchange authorization code for access token
-        import requests
         token_url = (
             f"https://graph.facebook.com/v16.0/oauth/access_token?"
             f"client_id={APP_ID}&"
@@ -59,7 +123,7 @@ def handle_callback(user_id, auth_code, state):
             f"code={auth_code}"
         )
         
-        response = requests.get(token_url)
+        response = http_session().get(token_url, timeout=META_HTTP_TIMEOUT)
         token_data = response.json()
         
         if 'error' in token_data:
@@ -74,7 +138,7 @@ def handle_callback(user_id, auth_code, state):
             f"fb_exchange_token={token_data['access_token']}"
         )
         
-        response = requests.get(long_lived_token_url)
+        response = http_session().get(long_lived_token_url, timeout=META_HTTP_TIMEOUT)
         long_lived_token_data = response.json()
         
         if 'error' in long_lived_token_data:
@@ -87,7 +151,10 @@ def handle_callback(user_id, auth_code, state):
             "expires_in": long_lived_token_data.get('expires_in', 0),
             "created_at": datetime.now().isoformat()
         }
-        save_credentials(user_id, "meta_ads", creds_data)
+        save_credentials(
+            user_id, "meta_ads", creds_data,
+            expires_at=get_token_expiry_timestamp("meta_ads", creds_data)
+        )
         
         return True, "Successfully authenticated with Meta Ads"
     except Exception as e:
@@ -97,17 +164,14 @@ def handle_callback(user_id, auth_code, state):
 def get_ad_accounts(user_id):
     """Get list of Meta Ad Accounts"""
     try:
-        # Get credentials
-        creds_data = get_credentials(user_id, "meta_ads")
-        if not creds_data:
-            return None, "No credentials found"
-        
-        # Initialize the API
-        FacebookAdsApi.init(APP_ID, APP_SECRET, creds_data["access_token"])
+        # Get the user's API instance
+        api, error = get_api(user_id)
+        if error:
+            return None, error
         
         # Get user's ad accounts
         from facebook_business.adobjects.user import User
-        me = User(fbid='me')
+        me = User(fbid='me', api=api)
         accounts = me.get_ad_accounts(fields=['name', 'account_id', 'account_status'])
         
         return [account.export_all_data() for account in accounts], None
@@ -116,42 +180,79 @@ def get_ad_accounts(user_id):
     except Exception as e:
         return None, f"Error: {str(e)}"
 
-def get_ad_insights(user_id, account_id, start_date=None, end_date=None, fields=None):
-    """Get Meta Ads insights for an account"""
+def _resolve_insight_args(start_date=None, end_date=None, fields=None):
+    """Fill in the default date range and fields"""
+    # Default dates if not provided
+    if not start_date:
+        start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    if not end_date:
+        end_date = datetime.now().strftime('%Y-%m-%d')
+    
+    # Default fields if not provided
+    if not fields:
+        fields = [
+            'campaign_name',
+            'impressions',
+            'clicks',
+            'spend',
+            'ctr',
+            'cpc',
+            'reach',
+            'frequency'
+        ]
+    
+    return start_date, end_date, fields
+
+def is_insight_field(name):
+    """Check whether a name is a valid insights field"""
+    return not name.startswith('_') and getattr(AdsInsights.Field, name, None) == name
+
+def get_ad_insights(user_id, account_id, start_date=None, end_date=None, fields=None, async_job=False, level='campaign', shard=None):
+    """Get Meta Ads insights for an account
+    
+    With async_job=True an AdReportRun is started instead and its job status is
+    returned; the result is stored once the run finishes (see integrations.meta_jobs).
+    With shard='day', 'week' or 'month' the range is fetched as concurrent slices of
+    that size and the rows are concatenated in date order; each slice's rows cover
+    only that slice, as their date_start and date_stop show. The two cannot be
+    combined; asking for both returns SHARD_ASYNC_ERROR.
+    """
+    if shard and async_job:
+        return None, SHARD_ASYNC_ERROR
+    
     try:
-        # Default dates if not provided
-        if not start_date:
-            start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        if not end_date:
-            end_date = datetime.now().strftime('%Y-%m-%d')
-        
-        # Default fields if not provided
-        if not fields:
-            fields = [
-                'campaign_name',
-                'impressions',
-                'clicks',
-                'spend',
-                'ctr',
-                'cpc',
-                'reach',
-                'frequency'
-            ]
-        
-        # Get credentials
-        creds_data = get_credentials(user_id, "meta_ads")
-        if not creds_data:
-            return None, "No credentials found"
-        
-        # Initialize the API
-        FacebookAdsApi.init(APP_ID, APP_SECRET, creds_data["access_token"])
+        start_date, end_date, fields = _resolve_insight_args(start_date, end_date, fields)
+        
+        if shard:
+            slices = split_date_range(start_date, end_date, shard)
+            results, error = fetch_sharded(
+                lambda slice_start, slice_end: get_ad_insights(user_id, account_id, slice_start, slice_end, fields, level=level),
+                slices
+            )
+            if error:
+                return None, error
+            return [row for rows in results for row in rows], None
+        
+        # Large ranges and breakdowns run as async report jobs
+        if async_job:
+            from integrations.meta_jobs import submit_insights_job
+            params = {
+                'time_range': {'since': start_date, 'until': end_date},
+                'level': level
+            }
+            return submit_insights_job(user_id, account_id, params, fields, META_PAGE_LIMIT)
+        
+        # Get the user's API instance
+        api, error = get_api(user_id)
+        if error:
+            return None, error
         
         # Get insights
-        account = AdAccount(f'act_{account_id}')
+        account = AdAccount(f'act_{account_id}', api=api)
         insights = account.get_insights(
             params={
                 'time_range': {'since': start_date, 'until': end_date},
-                'level': 'campaign'
+                'level': level
             },
             fields=fields
         )
@@ -162,11 +263,120 @@ def get_ad_insights(user_id, account_id, start_date=None, end_date=None, fields=
     except Exception as e:
         return None, f"Error: {str(e)}"
 
+def get_ad_insight_pages(user_id, account_id, start_date=None, end_date=None, fields=None, level='campaign', limit=None):
+    """Get a generator of insight pages that follows the Graph API cursor one page at a time
+    
+    The first page is requested before returning so credential and API errors are
+    reported up front; only one page of `limit` rows is held in memory at a time.
+    """
+    try:
+        start_date, end_date, fields = _resolve_insight_args(start_date, end_date, fields)
+        
+        # Get the user's API instance
+        api, error = get_api(user_id)
+        if error:
+            return None, error
+        
+        # Requesting the insights edge loads the first page
+        account = AdAccount(f'act_{account_id}', api=api)
+        cursor = account.get_insights(
+            params={
+                'time_range': {'since': start_date, 'until': end_date},
+                'level': level,
+                'limit': limit or META_PAGE_LIMIT
+            },
+            fields=fields
+        )
+    except FacebookRequestError as e:
+        return None, f"API Error: {e.api_error_message()}"
+    except Exception as e:
+        return None, f"Error: {str(e)}"
+
+    def pages():
+        while True:
+            yield [cursor[i].export_all_data() for i in range(len(cursor))]
+            
+            # Replaces the cursor's queue with the next page
+            if not cursor.load_next_page():
+                break
+    
+    return pages(), None
+
+def _fetch_account_insights(api, limiter, account_id, params, fields):
+    """Fetch every insights page of one account under the shared limiter"""
+    started = time.monotonic()
+    summary = {"account_id": account_id, "rows": 0, "pages": 0, "error": None}
+    rows = []
+    
+    try:
+        account = AdAccount(f'act_{account_id}', api=api)
+
+        def first_page():
+            cursor = account.get_insights(params=params, fields=fields)
+            return cursor, cursor.headers()
+        
+        cursor = limiter.call(first_page)
+        while True:
+            rows.extend(dict(cursor[i].export_all_data(), account_id=account_id) for i in range(len(cursor)))
+            summary["pages"] += 1
+            
+            if not limiter.call(lambda: (cursor.load_next_page(), cursor.headers())):
+                break
+    except FacebookRequestError as e:
+        summary["error"] = f"API Error: {e.api_error_message()}"
+    except Exception as e:
+        summary["error"] = f"Error: {str(e)}"
+    
+    summary["rows"] = len(rows)
+    summary["elapsed_ms"] = round((time.monotonic() - started) * 1000)
+    return rows, summary
+
+def get_multi_account_insights(user_id, account_ids, start_date=None, end_date=None, fields=None, level='campaign'):
+    """Get Meta Ads insights for several accounts concurrently, merged into one result
+    
+    Accounts are fetched on a pool of up to META_FANOUT_CONCURRENCY threads. Every
+    Graph API call goes through an AdaptiveLimiter that narrows concurrency and
+    pauses as Meta's usage headers approach their limits. A failing account is
+    reported in its summary and does not fail the others.
+    """
+    try:
+        start_date, end_date, fields = _resolve_insight_args(start_date, end_date, fields)
+        
+        # Get the user's API instance
+        api, error = get_api(user_id)
+        if error:
+            return None, error
+        
+        params = {
+            'time_range': {'since': start_date, 'until': end_date},
+            'level': level,
+            'limit': META_PAGE_LIMIT
+        }
+        account_ids = list(dict.fromkeys(str(account_id) for account_id in account_ids))
+        limiter = AdaptiveLimiter(META_FANOUT_CONCURRENCY)
+        
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(META_FANOUT_CONCURRENCY, len(account_ids)) or 1) as executor:
+            results = list(executor.map(
+                lambda account_id: _fetch_account_insights(api, limiter, account_id, params, fields),
+                account_ids
+            ))
+        
+        return {
+            "data": [row for rows, _ in results for row in rows],
+            "accounts": [summary for _, summary in results],
+            "elapsed_ms": round((time.monotonic() - started) * 1000),
+            "throttle": limiter.stats()
+        }, None
+    except Exception as e:
+        return None, f"Error: {str(e)}"
+
 def disconnect(user_id):
     """Disconnect Meta Ads for a user"""
     try:
-        # Remove credentials
+        # Remove credentials and the cached API instance
         delete_credentials(user_id, "meta_ads")
+        release_api(user_id)
         return True, None
     except Exception as e:
         return False, f"Error: {str(e)}" 
\ No newline at end of file
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from facebook_business.adobjects.adaccount import AdAccount
+from facebook_business.adobjects.adreportrun import AdReportRun
+from facebook_business.exceptions import FacebookRequestError
+from datasets import background
+from datasets.background import DATASET_DIR, shared_executor
+
+# Threads polling report runs; polling is I/O bound so threads are enough
+META_JOB_WORKERS = int(os.getenv('META_JOB_WORKERS', '4'))
+
+# Jobs allowed to be queued or running at once in this API process
+META_JOB_MAX_PENDING = int(os.getenv('META_JOB_MAX_PENDING', '16'))
+
+# Give up on report runs that have not finished after this many seconds
+META_JOB_TIMEOUT = float(os.getenv('META_JOB_TIMEOUT', '3600'))
+
+# Polling backoff: first delay, growth factor and ceiling in seconds
+POLL_INITIAL_DELAY = 2.0
+POLL_BACKOFF = 1.5
+POLL_MAX_DELAY = 30.0
+
+# Error returned when no job slot is free
+JOBS_BUSY_ERROR = "Too many insights jobs in progress, try again later"
+
+# Directory holding job status files and finished results
+META_JOB_DIR = os.path.join(DATASET_DIR, 'meta_jobs')
+
+_slots = threading.BoundedSemaphore(META_JOB_MAX_PENDING)
+
+def _get_executor():
+    """Get the shared polling thread pool, creating it on first use"""
+    return shared_executor(
+        'meta-job', lambda: ThreadPoolExecutor(max_workers=META_JOB_WORKERS, thread_name_prefix='meta-job')
+    )
+
+def result_path(job_id):
+    return os.path.join(META_JOB_DIR, f"{job_id}.ndjson")
+
+def read_job_status(job_id):
+    """Read an insights job's status, or None if the job does not exist"""
+    return background.read_job_status(META_JOB_DIR, job_id)
+
+def write_job_status(job_id, **fields):
+    """Merge fields into an insights job's status file"""
+    return background.write_job_status(META_JOB_DIR, job_id, **fields)
+
+def _write_results(job_id, run, page_limit):
+    """Page a finished report run's rows into the job's NDJSON result file"""
+    cursor = run.get_result(params={'limit': page_limit})
+    rows = 0
+    
+    temp_path = f"{result_path(job_id)}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        while True:
+            for i in range(len(cursor)):
+                f.write(json.dumps(cursor[i].export_all_data()) + '\n')
+            rows += len(cursor)
+            write_job_status(job_id, rows=rows)
+            
+            if not cursor.load_next_page():
+                break
+    os.replace(temp_path, result_path(job_id))
+    
+    return rows
+
+def _poll_report_run(job_id, run, page_limit):
+    """Wait for a report run with backoff, then store its result (runs on the thread pool)"""
+    try:
+        write_job_status(job_id, state='running')
+        
+        delay = POLL_INITIAL_DELAY
+        deadline = time.monotonic() + META_JOB_TIMEOUT
+        while True:
+            run = run.api_get(fields=[AdReportRun.Field.async_status, AdReportRun.Field.async_percent_completion])
+            status = run[AdReportRun.Field.async_status]
+            write_job_status(job_id, percent=run[AdReportRun.Field.async_percent_completion], report_status=status)
+            
+            if status == 'Job Completed':
+                break
+            if status in ('Job Failed', 'Job Skipped'):
+                raise RuntimeError(f"Report run ended with status: {status}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Report run did not finish within {META_JOB_TIMEOUT:.0f} seconds")
+            
+            time.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+        
+        rows = _write_results(job_id, run, page_limit)
+        write_job_status(job_id, state='completed', percent=100, rows=rows)
+        print(f"Meta insights job {job_id} completed ({rows} rows)")
+    except FacebookRequestError as e:
+        print(f"Meta insights job {job_id} failed: {e.api_error_message()}")
+        write_job_status(job_id, state='failed', error=f"API Error: {e.api_error_message()}")
+    except Exception as e:
+        print(f"Meta insights job {job_id} failed: {e}")
+        write_job_status(job_id, state='failed', error=str(e))
+    finally:
+        _slots.release()
+
+def submit_insights_job(user_id, account_id, params, fields, page_limit):
+    """Start an async report run and poll it in the background, returning (status, error)"""
+    from integrations.meta_ads import get_api
+    
+    api, error = get_api(user_id)
+    if error:
+        return None, error
+    
+    if not _slots.acquire(blocking=False):
+        return None, JOBS_BUSY_ERROR
+    
+    try:
+        # The report run keeps this API instance, so polling uses the same user's token
+        account = AdAccount(f'act_{account_id}', api=api)
+        run = account.get_insights_async(params=params, fields=fields)
+    except FacebookRequestError as e:
+        _slots.release()
+        return None, f"API Error: {e.api_error_message()}"
+    except Exception as e:
+        _slots.release()
+        return None, f"Error: {str(e)}"
+    
+    job_id = uuid.uuid4().hex
+    try:
+        background.cleanup_job_files(META_JOB_DIR)
+        status = write_job_status(
+            job_id, state='queued', user_id=user_id, account_id=account_id,
+            report_run_id=run.get_id(), percent=0, rows=0, error=None
+        )
+        _get_executor().submit(_poll_report_run, job_id, run, page_limit)
+    except Exception as e:
+        # Nothing will poll the run, so give its slot back
+        _slots.release()
+        return None, f"Error: {str(e)}"
+    
+    return status, None
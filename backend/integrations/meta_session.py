@@ -0,0 +1,28 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# Keep-alive connections to graph.facebook.com shared by every user; calls wait for a free one past the limit
+META_HTTP_POOL_SIZE = int(os.getenv('META_HTTP_POOL_SIZE', '32'))
+META_HTTP_TIMEOUT = float(os.getenv('META_HTTP_TIMEOUT', '60'))
+
+# One adapter means one urllib3 pool manager behind every session mounted on it
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=META_HTTP_POOL_SIZE, pool_block=True)
+
+_session = None
+_session_lock = threading.Lock()
+
+def mount_pool(session):
+    """Route a requests session's HTTPS traffic through the shared connection pool"""
+    # Sessions mounted here must not be closed, as that would close the shared adapter
+    session.mount('https://', _adapter)
+    return session
+
+def http_session():
+    """Get the shared session for Graph API calls made without an SDK object, such as token exchanges"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = mount_pool(requests.Session())
+        return _session
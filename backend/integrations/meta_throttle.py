@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+from facebook_business.exceptions import FacebookRequestError
+
+# Above this usage percentage the allowed concurrency is halved; below half of it, it grows again
+META_USAGE_THRESHOLD = float(os.getenv('META_USAGE_THRESHOLD', '75'))
+
+# At this usage percentage new calls stop until Meta's reset window has passed
+META_USAGE_PAUSE = float(os.getenv('META_USAGE_PAUSE', '95'))
+META_USAGE_PAUSE_SECONDS = 60.0
+
+# Rate-limited calls are retried this many times, waiting RETRY_BASE_DELAY * 2**attempt without a reset hint
+META_RATE_LIMIT_RETRIES = int(os.getenv('META_RATE_LIMIT_RETRIES', '3'))
+RETRY_BASE_DELAY = 5.0
+
+# Graph API error codes meaning the app, user, account or business use case is throttled
+RATE_LIMIT_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+
+def _load_header(headers, name):
+    """Decode one JSON usage header, or None"""
+    try:
+        value = headers.get(name)
+        return json.loads(value) if value else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def parse_usage(headers):
+    """Read Meta's usage headers into (highest usage percentage, seconds until access is regained)"""
+    usage, wait = [], 0.0
+    
+    # App-level and ad account usage
+    app_usage = _load_header(headers, 'x-app-usage') or {}
+    usage.extend(v for k, v in app_usage.items() if k in ('call_count', 'total_cputime', 'total_time'))
+    
+    # The account's reset duration is reported at any usage, so it only matters near the limit
+    account_usage = _load_header(headers, 'x-ad-account-usage') or {}
+    if 'acc_id_util_pct' in account_usage:
+        usage.append(account_usage['acc_id_util_pct'])
+        if float(account_usage['acc_id_util_pct']) >= META_USAGE_PAUSE:
+            wait = max(wait, float(account_usage.get('reset_time_duration') or 0))
+    
+    # Business use case usage, keyed by business ID; the regain estimate is in minutes
+    business_usage = _load_header(headers, 'x-business-use-case-usage') or {}
+    for entries in business_usage.values():
+        for entry in entries if isinstance(entries, list) else []:
+            usage.extend(entry.get(k, 0) for k in ('call_count', 'total_cputime', 'total_time'))
+            wait = max(wait, float(entry.get('estimated_time_to_regain_access') or 0) * 60)
+    
+    numbers = [float(v) for v in usage if isinstance(v, (int, float))]
+    return (max(numbers) if numbers else None), wait
+
+def is_rate_limited(error):
+    """Check whether a Graph API error is a throttling error"""
+    return error.api_error_code() in RATE_LIMIT_CODES
+
+class AdaptiveLimiter:
+    """Bounds concurrent Graph API calls, narrowing the bound as Meta reports rising usage"""
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.paused_until = 0.0
+        self.peak_usage = 0.0
+        self.throttled = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free call slot outside any pause"""
+        with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.active < self.limit:
+                    self.active += 1
+                    return
+                self._cond.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, usage=None, wait=0.0):
+        """Free a call slot, adjusting concurrency to the usage the call reported"""
+        with self._cond:
+            self.active -= 1
+            
+            if usage is not None:
+                self.peak_usage = max(self.peak_usage, usage)
+                # Multiplicative decrease near the limit, additive increase well below it
+                if usage >= META_USAGE_THRESHOLD:
+                    self.limit = max(1, self.limit // 2)
+                elif usage < META_USAGE_THRESHOLD / 2 and self.limit < self.max_concurrency:
+                    self.limit += 1
+                
+                if usage >= META_USAGE_PAUSE:
+                    wait = max(wait, META_USAGE_PAUSE_SECONDS)
+            
+            if wait > 0:
+                self.paused_until = max(self.paused_until, time.monotonic() + wait)
+            
+            self._cond.notify_all()
+
+    def call(self, request):
+        """Run request() -> (result, headers) in a slot, retrying throttling errors after a pause"""
+        for attempt in range(META_RATE_LIMIT_RETRIES + 1):
+            self.acquire()
+            try:
+                result, headers = request()
+            except FacebookRequestError as e:
+                usage, wait = parse_usage(e.http_headers() or {})
+                if not is_rate_limited(e) or attempt == META_RATE_LIMIT_RETRIES:
+                    self.release(usage, wait)
+                    raise
+                
+                # Narrow the bound and wait for the reset hint, or back off exponentially without one
+                with self._cond:
+                    self.throttled += 1
+                self.release(max(usage or 0, META_USAGE_THRESHOLD), wait or RETRY_BASE_DELAY * 2 ** attempt)
+                continue
+            except Exception:
+                self.release()
+                raise
+            
+            self.release(*parse_usage(headers or {}))
+            return result
+
+    def stats(self):
+        """Get the current bound and the highest usage seen"""
+        with self._cond:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'final_concurrency': self.limit,
+                'peak_usage_pct': self.peak_usage,
+                'throttled_calls': self.throttled
+            }
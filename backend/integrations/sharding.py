@@ -0,0 +1,76 @@
+import os
+import time
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# Date slices fetched at once per report, and retries of a failing slice
+REPORT_SHARD_CONCURRENCY = int(os.getenv('REPORT_SHARD_CONCURRENCY', '4'))
+REPORT_SHARD_RETRIES = int(os.getenv('REPORT_SHARD_RETRIES', '2'))
+
+# A failing slice waits RETRY_BASE_DELAY * 2**attempt seconds before it is retried
+RETRY_BASE_DELAY = 1.0
+
+SHARD_SIZES = ('day', 'week', 'month')
+
+def split_date_range(start_date, end_date, size):
+    """Split an ISO date range into (start, end) slices on calendar week or month boundaries"""
+    if size not in SHARD_SIZES:
+        raise ValueError(f"Unknown slice size: {size}")
+    
+    start, end = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    slices = []
+    while start <= end:
+        # Weeks end on Sunday and months on their last day, so slices line up across reports
+        if size == 'day':
+            stop = start
+        elif size == 'week':
+            stop = start + timedelta(days=6 - start.weekday())
+        else:
+            stop = (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        
+        stop = min(stop, end)
+        slices.append((start.isoformat(), stop.isoformat()))
+        start = stop + timedelta(days=1)
+    
+    return slices
+
+def _fetch_slice(fetch, date_slice, retries):
+    """Fetch one slice, retrying with backoff while it fails"""
+    for attempt in range(retries + 1):
+        try:
+            result, error = fetch(*date_slice)
+        except Exception as e:
+            result, error = None, f"Error: {str(e)}"
+        
+        if not error:
+            return result, None
+        if attempt < retries:
+            time.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+    
+    return None, f"{date_slice[0]} to {date_slice[1]}: {error}"
+
+def fetch_sharded(fetch, slices, concurrency=None, retries=None):
+    """Fetch date slices on a bounded thread pool, returning (results in slice order, error)
+    
+    fetch(start_date, end_date) returns (result, error) like the integrations
+    functions. Each slice is retried on its own; if one still fails, slices that
+    have not started are cancelled and its error is returned.
+    """
+    concurrency = concurrency or REPORT_SHARD_CONCURRENCY
+    retries = REPORT_SHARD_RETRIES if retries is None else retries
+    if not slices:
+        return [], None
+    
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(slices)), thread_name_prefix='report-shard') as executor:
+        futures = [executor.submit(_fetch_slice, fetch, date_slice, retries) for date_slice in slices]
+        
+        results = []
+        for future in futures:
+            result, error = future.result()
+            if error:
+                for pending in futures:
+                    pending.cancel()
+                return None, error
+            results.append(result)
+    
+    return results, None
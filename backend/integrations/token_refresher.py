@@ -0,0 +1,250 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from google.auth.transport.requests import Request
+from config.credentials import (
+    get_credentials, save_credentials, iter_credentials, set_credentials_expiry,
+    find_expiring_credentials, lease_credentials, extend_credentials_lease
+)
+from integrations.google_clients import build_credentials, update_pooled_token
+from integrations.meta_ads import APP_ID, APP_SECRET
+from integrations.meta_session import http_session, META_HTTP_TIMEOUT
+from integrations.utils import get_token_expiry, get_token_expiry_timestamp
+
+# How often the credential store is scanned for tokens close to expiry
+TOKEN_REFRESH_INTERVAL = float(os.getenv('TOKEN_REFRESH_INTERVAL', '120'))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv('TOKEN_REFRESH_CONCURRENCY', '4'))
+
+# Random spread added to refresh windows and scan intervals so workers and users drift apart
+TOKEN_REFRESH_JITTER = float(os.getenv('TOKEN_REFRESH_JITTER', '0.2'))
+
+# Renew this long before expiry; GA access tokens last an hour, Meta long-lived tokens about 60 days
+REFRESH_AHEAD = {
+    'google_analytics': timedelta(seconds=float(os.getenv('GA_TOKEN_REFRESH_AHEAD', '600'))),
+    'meta_ads': timedelta(days=float(os.getenv('META_TOKEN_REFRESH_AHEAD_DAYS', '7')))
+}
+
+# Users who have not used an integration for this many days are not refreshed (0 refreshes everyone)
+TOKEN_REFRESH_INACTIVE_DAYS = float(os.getenv('TOKEN_REFRESH_INACTIVE_DAYS', '30'))
+
+# A worker claims a token for this many seconds before refreshing it, so no other worker does too
+TOKEN_REFRESH_LEASE = float(os.getenv('TOKEN_REFRESH_LEASE', '300'))
+
+# Failed refreshes are retried with exponential backoff up to this many seconds
+MAX_RETRY_DELAY = 86400
+
+META_TOKEN_URL = "https://graph.facebook.com/v16.0/oauth/access_token"
+
+_thread = None
+_thread_lock = threading.Lock()
+
+# (user_id, service) keys being refreshed, and retry state of failed ones
+_in_flight = set()
+_failures = {}
+_state_lock = threading.Lock()
+_stats = {'sweeps': 0, 'refreshed': 0, 'failed': 0, 'skipped': 0, 'leased_elsewhere': 0, 'last_sweep': None}
+
+def _now(service):
+    """Current time in the clock each service's expiry is stored in"""
+    # google-auth stores expiry as naive UTC; Meta's created_at is naive local time
+    if service == 'google_analytics':
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    return datetime.now()
+
+def _is_due(service, creds):
+    """Check whether a token still expires within the widest refresh window a sweep can pick"""
+    expiry = get_token_expiry(service, creds)
+    if expiry is None:
+        return False
+    
+    return expiry - _now(service) <= REFRESH_AHEAD[service] * (1 + TOKEN_REFRESH_JITTER)
+
+def refresh_google_token(user_id):
+    """Refresh a user's GA access token and store it"""
+    creds_data = get_credentials(user_id, 'google_analytics')
+    if not creds_data or not creds_data.get('refresh_token'):
+        return False, "No refresh token"
+    
+    # Another worker may have refreshed it since the sweep
+    if not _is_due('google_analytics', creds_data):
+        return False, None
+    
+    credentials = build_credentials(creds_data)
+    credentials.refresh(Request())
+    
+    # Keep a reconnect that happened during the refresh
+    current = get_credentials(user_id, 'google_analytics')
+    if not current or current.get('refresh_token') != creds_data.get('refresh_token'):
+        return False, "Credentials changed during refresh"
+    
+    current['token'] = credentials.token
+    current['expiry'] = credentials.expiry.isoformat() if credentials.expiry else None
+    save_credentials(
+        user_id, 'google_analytics', current,
+        expires_at=get_token_expiry_timestamp('google_analytics', current)
+    )
+    
+    # Pooled clients pick up the new token without being rebuilt
+    update_pooled_token(user_id, credentials.token, credentials.expiry)
+    
+    return True, None
+
+def refresh_meta_token(user_id):
+    """Exchange a user's long-lived Meta token for a fresh one and store it"""
+    creds_data = get_credentials(user_id, 'meta_ads')
+    if not creds_data or not creds_data.get('access_token'):
+        return False, "No access token"
+    
+    if not _is_due('meta_ads', creds_data):
+        return False, None
+    
+    response = http_session().get(META_TOKEN_URL, params={
+        'grant_type': 'fb_exchange_token',
+        'client_id': APP_ID,
+        'client_secret': APP_SECRET,
+        'fb_exchange_token': creds_data['access_token']
+    }, timeout=META_HTTP_TIMEOUT)
+    token_data = response.json()
+    
+    if 'error' in token_data:
+        return False, token_data['error'].get('message', 'Token exchange failed')
+    
+    current = get_credentials(user_id, 'meta_ads')
+    if not current or current.get('access_token') != creds_data['access_token']:
+        return False, "Credentials changed during refresh"
+    
+    current.update({
+        "access_token": token_data['access_token'],
+        "token_type": token_data.get('token_type', current.get('token_type', 'bearer')),
+        "expires_in": token_data.get('expires_in', 0),
+        "created_at": datetime.now().isoformat()
+    })
+    save_credentials(user_id, 'meta_ads', current, expires_at=get_token_expiry_timestamp('meta_ads', current))
+    
+    return True, None
+
+REFRESHERS = {
+    'google_analytics': refresh_google_token,
+    'meta_ads': refresh_meta_token
+}
+
+def _refresh(key):
+    """Refresh one token, recording the outcome"""
+    user_id, service = key
+    try:
+        refreshed, error = REFRESHERS[service](user_id)
+    except Exception as e:
+        refreshed, error = False, str(e)
+    
+    with _state_lock:
+        _in_flight.discard(key)
+        if error:
+            # Back off exponentially so revoked grants are not hammered every sweep
+            attempts = _failures.get(key, (0, 0))[0] + 1
+            delay = min(TOKEN_REFRESH_INTERVAL * 2 ** attempts, MAX_RETRY_DELAY)
+            _failures[key] = (attempts, time.monotonic() + delay)
+            _stats['failed'] += 1
+        else:
+            _failures.pop(key, None)
+            _stats['refreshed' if refreshed else 'skipped'] += 1
+    
+    if error:
+        print(f"Error refreshing {service} token for user {user_id}: {error}")
+        
+        # Keep the lease for the backoff so other workers wait too
+        try:
+            extend_credentials_lease(user_id, service, delay)
+        except Exception as e:
+            print(f"Error extending refresh lease for user {user_id}: {e}")
+
+def index_token_expiry():
+    """Store the plaintext expiry of records saved before it was kept, decrypting only those"""
+    indexed = 0
+    for user_id, service, creds in iter_credentials(list(REFRESHERS), missing_expiry=True):
+        expires_at = get_token_expiry_timestamp(service, creds)
+        if expires_at is not None:
+            set_credentials_expiry(user_id, service, expires_at)
+            indexed += 1
+    
+    return indexed
+
+def sweep(executor):
+    """Queue a refresh for every token of an active user inside its refresh window
+    
+    Candidates come from the plaintext expires_at index, so nothing is decrypted
+    here. Each is leased before it is queued, so one worker refreshes it.
+    """
+    now = time.monotonic()
+    queued = 0
+    used_since = time.time() - TOKEN_REFRESH_INACTIVE_DAYS * 86400 if TOKEN_REFRESH_INACTIVE_DAYS > 0 else None
+    
+    for service, ahead in REFRESH_AHEAD.items():
+        # Widen each sweep's window at random so workers and users drift apart
+        expires_before = time.time() + ahead.total_seconds() * (1 + random.uniform(0, TOKEN_REFRESH_JITTER))
+        
+        for user_id in find_expiring_credentials(service, expires_before, used_since):
+            key = (user_id, service)
+            with _state_lock:
+                if key in _in_flight or _failures.get(key, (0, 0))[1] > now:
+                    continue
+            
+            if not lease_credentials(user_id, service, TOKEN_REFRESH_LEASE):
+                with _state_lock:
+                    _stats['leased_elsewhere'] += 1
+                continue
+            
+            with _state_lock:
+                _in_flight.add(key)
+            executor.submit(_refresh, key)
+            queued += 1
+    
+    with _state_lock:
+        _stats['sweeps'] += 1
+        _stats['last_sweep'] = datetime.now().isoformat()
+    
+    return queued
+
+def _refresh_loop():
+    """Scan for expiring tokens forever, refreshing at most TOKEN_REFRESH_CONCURRENCY at once"""
+    try:
+        index_token_expiry()
+    except Exception as e:
+        print(f"Error indexing token expiry: {e}")
+    
+    with ThreadPoolExecutor(max_workers=TOKEN_REFRESH_CONCURRENCY, thread_name_prefix='token-refresh') as executor:
+        while True:
+            try:
+                sweep(executor)
+            except Exception as e:
+                print(f"Error sweeping tokens: {e}")
+            
+            time.sleep(TOKEN_REFRESH_INTERVAL * (1 + random.uniform(-TOKEN_REFRESH_JITTER, TOKEN_REFRESH_JITTER)))
+
+def start_token_refresher():
+    """Start the background token refresher, once per process"""
+    global _thread
+    
+    if TOKEN_REFRESH_INTERVAL <= 0:
+        return False
+    
+    with _thread_lock:
+        if _thread and _thread.is_alive():
+            return False
+        
+        _thread = threading.Thread(target=_refresh_loop, name='token-refresher', daemon=True)
+        _thread.start()
+    
+    return True
+
+def get_refresher_stats():
+    """Get counters of the background token refresher"""
+    with _state_lock:
+        return dict(
+            _stats,
+            in_flight=len(_in_flight),
+            backing_off=len(_failures),
+            running=bool(_thread and _thread.is_alive())
+        )
@@ -1,51 +1,137 @@
 import json
-from datetime import datetime, timedelta
-from config.credentials import get_credentials
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from operator import itemgetter
+from config.credentials import get_credentials, iter_credentials
+from datasets.downsample import downsample_indices, method_for_chart
+
+# Services reported by the integration status helpers
+STATUS_SERVICES = ("google_analytics", "meta_ads")
+
+def get_token_expiry(service, creds):
+    """Get the access token expiry of stored credentials, if known"""
+    if service == "google_analytics" and creds.get("expiry"):
+        return datetime.fromisoformat(creds["expiry"])
+    
+    if service == "meta_ads" and creds.get("created_at") and creds.get("expires_in"):
+        created_at = datetime.fromisoformat(creds["created_at"])
+        return created_at + timedelta(seconds=creds["expires_in"])
+    
+    return None
+
+def get_token_expiry_timestamp(service, creds):
+    """Get the access token expiry of stored credentials as a Unix timestamp, if known"""
+    expiry = get_token_expiry(service, creds)
+    if expiry is None:
+        return None
+    
+    # google-auth stores expiry as naive UTC; Meta's created_at is naive local time
+    if service == "google_analytics":
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry.timestamp()
+
+def _service_status(service, creds, now):
+    """Build the status entry of one integration from its stored credentials"""
+    status = {
+        "connected": False,
+        "last_sync": None,
+        "error": None,
+        "expires_at": None
+    }
+    
+    if creds:
+        status["connected"] = True
+        
+        # Check if token is expired
+        expiry = get_token_expiry(service, creds)
+        if expiry:
+            status["expires_at"] = expiry.isoformat()
+            if expiry < now:
+                status["error"] = "Token expired"
+    
+    return status
 
 def get_integration_status(user_id):
     """Get status of all integrations for a user"""
-    integrations = {
-        "google_analytics": {
-            "connected": False,
-            "last_sync": None,
-            "error": None
-        },
-        "meta_ads": {
-            "connected": False,
-            "last_sync": None,
-            "error": None
-        }
+    now = datetime.now()
+    return {
+        service: _service_status(service, get_credentials(user_id, service), now)
+        for service in STATUS_SERVICES
     }
+
+def get_all_integration_statuses(expiring_within_days=None, services=None):
+    """Yield the integration status of every user with stored credentials, in one pass over the store"""
+    services = [service for service in (services or STATUS_SERVICES) if service in STATUS_SERVICES]
+    if not services:
+        return
+    
+    now = datetime.now()
+    cutoff = now + timedelta(days=expiring_within_days) if expiring_within_days is not None else None
     
-    # Check Google Analytics
-    ga_creds = get_credentials(user_id, "google_analytics")
-    if ga_creds:
-        integrations["google_analytics"]["connected"] = True
+    # Records arrive ordered by user, so each user's services are adjacent
+    for user_id, records in groupby(iter_credentials(services), key=itemgetter(0)):
+        creds = {service: data for _, service, data in records}
         
-        # Check if token is expired
-        if ga_creds.get("expiry"):
-            expiry = datetime.fromisoformat(ga_creds["expiry"])
-            if expiry < datetime.now():
-                integrations["google_analytics"]["error"] = "Token expired"
-    
-    # Check Meta Ads
-    meta_creds = get_credentials(user_id, "meta_ads")
-    if meta_creds:
-        integrations["meta_ads"]["connected"] = True
+        # Keep only users with a token that is expired or expires before the cutoff
+        if cutoff is not None:
+            expiries = [get_token_expiry(service, data) for service, data in creds.items()]
+            if not any(expiry and expiry <= cutoff for expiry in expiries):
+                continue
         
-        # Check if token is expired
-        if meta_creds.get("created_at") and meta_creds.get("expires_in"):
-            created_at = datetime.fromisoformat(meta_creds["created_at"])
-            expires_in = meta_creds["expires_in"]
-            expiry = created_at + timedelta(seconds=expires_in)
-            
-            if expiry < datetime.now():
-                integrations["meta_ads"]["error"] = "Token expired"
-    
-    return integrations
+        yield {
+            "user_id": int(user_id) if user_id.isdigit() else user_id,
+            "integrations": {
+                service: _service_status(service, creds.get(service), now)
+                for service in services
+            }
+        }
+
+def _format_columnar_chart_data(data, chart_type, max_points):
+    """Format typed columnar data for Chart.js without touching individual cells"""
+    dimensions = data.get("dimensions", [])
+    metrics = data.get("metrics", [])
+    columns = data.get("columns", {})
+    
+    if not dimensions or not metrics or dimensions[0] not in columns or not len(columns[dimensions[0]]):
+        return None
+    
+    labels = np.asarray(columns[dimensions[0]])
+    values = [np.asarray(columns[metric], dtype=np.float64) for metric in metrics]
+    
+    # Downsample on the first metric so every dataset keeps the same labels
+    if max_points and len(labels) > max_points:
+        indices = downsample_indices(values[0], max_points, method=method_for_chart(chart_type))
+        labels = labels[indices]
+        values = [column[indices] for column in values]
+    
+    # Dates are labelled YYYYMMDD, as GA sends them in row dicts
+    if np.issubdtype(labels.dtype, np.datetime64):
+        labels = np.char.replace(np.datetime_as_string(labels, unit='D'), '-', '')
+    
+    return {
+        "labels": labels.tolist(),
+        "datasets": [
+            {
+                "label": metric,
+                "data": column.tolist(),
+                "borderColor": get_color(i),
+                "backgroundColor": get_color(i, 0.2),
+                "borderWidth": 2,
+                "tension": 0.4 if chart_type == "line" else 0
+            }
+            for i, (metric, column) in enumerate(zip(metrics, values))
+        ]
+    }
 
-def format_chart_data(data, chart_type="line"):
-    """Format data for Chart.js"""
+def format_chart_data(data, chart_type="line", max_points=None):
+    """Format data for Chart.js, optionally downsampled to max_points labels
+    
+    Accepts row dicts under "rows" or typed arrays under "columns".
+    """
+    if data and isinstance(data, dict) and "columns" in data:
+        return _format_columnar_chart_data(data, chart_type, max_points)
+    
     if not data or not isinstance(data, dict) or "rows" not in data:
         return None
     
@@ -57,6 +143,12 @@ def format_chart_data(data, chart_type="line"):
     if not dimensions or not metrics or not rows:
         return None
     
+    # Downsample on the first metric so every dataset keeps the same labels
+    if max_points and len(rows) > max_points:
+        primary = np.array([row.get(metrics[0], 0) for row in rows], dtype=np.float64)
+        indices = downsample_indices(primary, max_points, method=method_for_chart(chart_type))
+        rows = [rows[i] for i in indices]
+    
     # Prepare chart data
     chart_data = {
         "labels": [],
@@ -0,0 +1,18 @@
+"""
+Script to migrate the legacy credentials.json blob into the per-record credential store.
+Run this once before deploying; the application also migrates automatically on first use.
+"""
+
+from config.credentials import migrate_credentials_file, CREDENTIALS_DB
+
+def migrate_credentials():
+    """Migrate encrypted credentials to per-record storage"""
+    try:
+        count = migrate_credentials_file()
+        print(f"Credential store ready at {CREDENTIALS_DB} ({count} records migrated).")
+    
+    except Exception as e:
+        print(f"Error migrating credentials: {str(e)}")
+
+if __name__ == '__main__':
+    migrate_credentials()
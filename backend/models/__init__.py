@@ -1,2 +1,2 @@
 # Models package initialization 
-from .models import db, User 
\ No newline at end of file
+from .models import db, User, Dataset 
\ No newline at end of file
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+import json
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -59,4 +60,38 @@ class User(db.Model):
         
         if 'metaAds' in settings:
             self.meta_app_id = settings['metaAds'].get('appId', '')
-            self.meta_app_secret = settings['metaAds'].get('appSecret', '') 
\ No newline at end of file
+            self.meta_app_secret = settings['metaAds'].get('appSecret', '') 
+
+class Dataset(db.Model):
+    __tablename__ = 'datasets'
+    __table_args__ = (db.UniqueConstraint('user_id', 'content_hash'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size_bytes = db.Column(db.BigInteger, default=0)
+    row_count = db.Column(db.Integer, default=0)
+    columns_json = db.Column(db.Text, default='[]')
+    report_json = db.Column(db.Text, default='{}')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref=db.backref('datasets', lazy='dynamic'))
+    
+    @property
+    def columns(self):
+        return json.loads(self.columns_json or '[]')
+    
+    @property
+    def report(self):
+        return json.loads(self.report_json or '{}')
+    
+    def to_dict(self):
+        return {
+            'id': self.content_hash,
+            'filename': self.filename,
+            'size_bytes': self.size_bytes,
+            'rows': self.row_count,
+            'columns': self.columns,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
\ No newline at end of file